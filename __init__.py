@@ -1,2 +1,2 @@
-from homogenous import generate
-from modify import modify
+from homogenous import generate, generate_many
+from modify import modify, modify_sweep
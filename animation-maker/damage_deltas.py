@@ -0,0 +1,166 @@
+# Delta encoded animation frames. A keyframe holds every shown point, the frames after it
+# only the points that changed since, so a long run is a fraction of the size of full frames.
+# The file starts with the node labels of the field, then one record per frame:
+# frame id, point count and kind as int32, then node index as int32 and x, y and value as float32.
+# Kept python 2 compatible, since abaqus python writes it
+import os, struct
+import numpy as np
+
+magic = b"DELTAS1\n"
+count_header = struct.Struct("<i")
+header = struct.Struct("<iii")  # frame id, number of points, kind
+delta, keyframe = 0, 1
+
+threshold = 0.01  # points with values above this are shown
+keyframe_every = 50  # frames, bounds how far back a reader replays
+position_tolerance = 0.05  # mm a shown point moves before it is written again
+
+
+class DeltaWriter:
+    """
+    Appends frames of a field to a delta file, comparing each frame with what
+    the file already holds so only changed points are written
+    """
+
+    def __init__(self, filename, labels):
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.lookup = np.full(self.labels.max() + 1, -1, dtype=np.int64)
+        self.lookup[self.labels] = np.arange(len(self.labels))
+        self.x = np.zeros(len(self.labels), dtype=np.float32)
+        self.y = np.zeros(len(self.labels), dtype=np.float32)
+        self.values = np.zeros(len(self.labels), dtype=np.float32)
+        self.since_keyframe = None  # frames written since the last keyframe
+        self.f = open(filename, "wb")
+        self.f.write(magic)
+        self.f.write(count_header.pack(len(self.labels)))
+        self.labels.astype("<i4").tofile(self.f)
+
+    def write(self, frame_id, labels, x, y, values):
+        """
+        Adds one frame of the field, flushed so a reader sees every finished frame
+        """
+        if labels.max() >= len(self.lookup) or (self.lookup[labels] < 0).any():
+            raise ValueError("node labels are not in the first frame")
+        nodes = self.lookup[labels]
+        x, y = np.asarray(x, np.float32), np.asarray(y, np.float32)
+        values = np.asarray(values, np.float32)
+        shown = values > threshold
+        was_shown = self.values[nodes] > threshold
+        moved = (
+            np.maximum(np.abs(x - self.x[nodes]), np.abs(y - self.y[nodes]))
+            > position_tolerance
+        )
+        # hidden points only matter once they are shown
+        changed = (shown != was_shown) | (
+            shown & ((values != self.values[nodes]) | moved)
+        )
+        # a keyframe when one is due, or when it would be no bigger than the delta
+        if (
+            self.since_keyframe is None
+            or self.since_keyframe + 1 >= keyframe_every
+            or changed.sum() >= shown.sum()
+        ):
+            kind = keyframe
+            changed = shown
+            self.values[:] = 0
+            self.since_keyframe = 0
+        else:
+            kind = delta
+            self.since_keyframe += 1
+        nodes, x, y, values = nodes[changed], x[changed], y[changed], values[changed]
+        self.x[nodes], self.y[nodes], self.values[nodes] = x, y, values
+
+        self.f.write(header.pack(int(frame_id), len(nodes), kind))
+        nodes.astype("<i4").tofile(self.f)
+        for array in (x, y, values):
+            array.astype("<f4").tofile(self.f)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def read_labels(f):
+    f.seek(len(magic))
+    (count,) = count_header.unpack(f.read(count_header.size))
+    return np.fromfile(f, dtype="<i4", count=count)
+
+
+def read_index(filename):
+    """
+    Returns [(frame id, byte offset of its record, kind)] by hopping between record headers,
+    skipping a frame still being written
+    """
+    index = []
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(filename + " is not a delta file")
+        offset = len(magic) + count_header.size + 4 * len(read_labels(f))
+        while offset + header.size <= size:
+            f.seek(offset)
+            frame_id, count, kind = header.unpack(f.read(header.size))
+            end = offset + header.size + 4 * 4 * count
+            if end > size:
+                break
+            index.append((frame_id, offset, kind))
+            offset = end
+    return index
+
+
+class DeltaReader:
+    """
+    Rebuilds frames of a delta file. A frame is replayed from the nearest keyframe
+    before it, or onwards from the last frame read when that is closer
+    """
+
+    def __init__(self, filename):
+        self.index = read_index(filename)
+        self.f = open(filename, "rb")
+        num_nodes = len(read_labels(self.f))
+        self.x = np.zeros(num_nodes, dtype=np.float32)
+        self.y = np.zeros(num_nodes, dtype=np.float32)
+        self.values = np.zeros(num_nodes, dtype=np.float32)
+        self.current = -1  # frame number the arrays hold
+
+    def __len__(self):
+        return len(self.index)
+
+    def _apply(self, i):
+        self.f.seek(self.index[i][1])
+        frame_id, count, kind = header.unpack(self.f.read(header.size))
+        nodes = np.fromfile(self.f, dtype="<i4", count=count)
+        data = np.fromfile(self.f, dtype="<f4", count=3 * count)
+        if kind == keyframe:
+            self.values[:] = 0
+        self.x[nodes] = data[:count]
+        self.y[nodes] = data[count : 2 * count]
+        self.values[nodes] = data[2 * count :]
+        self.current = i
+
+    def frame(self, i):
+        """
+        Returns frame id, x, y and values of the shown points of frame i
+        """
+        start = i
+        while self.index[start][2] != keyframe:
+            start -= 1
+        if not start <= self.current <= i:
+            self.current = start - 1
+        for j in range(self.current + 1, i + 1):
+            self._apply(j)
+        shown = self.values > threshold
+        return self.index[i][0], self.x[shown], self.y[shown], self.values[shown]
+
+    def close(self):
+        self.f.close()
+
+
+def iter_deltas(filename):
+    """
+    Yields (frame id, x, y, values) one frame at a time, replaying each delta once
+    """
+    reader = DeltaReader(filename)
+    for i in range(len(reader)):
+        yield reader.frame(i)
+    reader.close()
@@ -1,7 +1,16 @@
-# Run with abaqus python .\post_processor.py .\filename.odb
+# Run with abaqus python .\odb_data_saver.py .\filename.odb "field output name"
+# Saves the points above 0.01 in every frame to data.bin as deltas, see damage_deltas.py
+import os, sys
 from odbAccess import *
 from sys import argv
-import json
+import numpy as np
+from damage_deltas import DeltaWriter
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "post_processing")
+)
+from odb_extractor import bulk_data
+from frame_archive import by_label
 
 compression = 1  # higher values run faster but skip more values
 odb_filename = argv[1]
@@ -12,34 +21,24 @@ except OdbError:
     print("Error: Could not find odb file.")
     exit(1)
 
-x_array = []
-y_array = []
-data_array = []
-json_data = {}
-total_frames = len(odb.steps.values()[0].frames)
-for frame in odb.steps.values()[-1].frames:
+frames = odb.steps.values()[-1].frames
+total_frames = len(frames)
+records = None
+for frame in frames:
     print("Saving Frame " + str(frame.frameId) + " of " + str(total_frames - 1))
-    coords = frame.fieldOutputs["COORD"]
     try:
         data = frame.fieldOutputs[fieldOutput]
     except KeyError:
         print("No field output named " + fieldOutput)
         exit(1)
-    for i in range(len(data.values)):
-        if i % compression == 0:  # low resolution
-            if data.values[i].data > 0.01:
-                x_array.append(coords.values[i].data[0])
-                y_array.append(coords.values[i].data[1])
-                data_array.append(data.values[i].data)
-            else:
-                pass
-    # abaqus python returns values as numpy floats,
-    # so we need to make them native before serialization
-    x_array = [float(i) for i in x_array]
-    y_array = [float(i) for i in y_array]
-    data_array = [float(i) for i in data_array]
-    json_data[int(frame.frameId)] = {"x": x_array, "y": y_array, "data": data_array}
-
-print("Saving to file...")
-json.dump(json_data, open("data.json", "w"), indent=4, sort_keys=True, default=str)
+    coord_labels, coords = bulk_data(frame.fieldOutputs["COORD"])
+    labels, values = bulk_data(data)
+    labels, values = labels[::compression], values[::compression, 0]  # low resolution
+    if records is None:  # the field's nodes are stored once, at the start
+        records = DeltaWriter("data.bin", labels)
+    coords = by_label(coord_labels, coords[:, :2])[labels]
+    # only the points that changed since the last frame are written
+    records.write(frame.frameId, labels, coords[:, 0], coords[:, 1], values)
+if records is not None:
+    records.close()
 print("Data Saved")
@@ -1,28 +1,116 @@
+# Run with python3 plot_maker.py {label}, reading data.bin from odb_data_saver.py,
+# or python3 plot_maker.py CSDMG {name}_frames to read the frame archive of a job instead.
+# Frames are rendered in parallel and piped straight into ffmpeg, making animation.mp4
 from matplotlib import pyplot as plt
 from matplotlib import cm
 import numpy as np
-import json
-from sys import argv
-
-label = argv[1]
-
-data = json.load(open("data.json", "r"))
-for frame in data.keys():
-    print(f"Plotting frame {frame}")
-    plt.figure()
-    x_arr = data[frame]["x"]
-    y_arr = data[frame]["y"]
-    values = data[frame]["data"]
-    plt.scatter(
-        x_arr,
-        y_arr,
-        s=1,
-        c=values,
-        cmap=cm.turbo,
-    )
+import argparse, os, subprocess, sys
+from damage_deltas import DeltaReader
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "post_processing")
+)
+from frame_archive import load_index, iter_frames, by_label
+
+ffmpeg = "ffmpeg"
+fps = 25  # ffmpeg's default when it read the pngs
+
+
+def archive_frame(directory: str, index: dict, i: int):
+    """
+    Returns x, y and CSDMG of the damaged nodes in frame i of the archive
+    """
+    frame = next(iter_frames(directory, index, i))
+    damaged = frame["csdmg"] > 0.01
+    coords = by_label(frame["coords_labels"], frame["coords"])
+    coords = coords[frame["csdmg_labels"][damaged]]
+    return coords[:, 0], coords[:, 1], frame["csdmg"][damaged]
+
+
+def setup_figure(label: str):
+    """
+    Makes the figure every frame is drawn on, returns the figure and its scatter artist
+    """
+    plt.switch_backend("Agg")
+    fig = plt.figure()
+    scatter = plt.scatter([], [], s=1, c=[], cmap=cm.turbo)
     cbar = plt.colorbar()
     cbar.set_label(label, labelpad=10, rotation=270)
     plt.xlim(0, 80)
     plt.ylim(0, 80)
-    plt.savefig(f"frame_{frame}.png")
-    plt.close()
+    return fig, scatter
+
+
+_worker = {}  # figure and frame source of each worker process
+
+
+def _init_worker(label: str, source: str):
+    _worker["fig"], _worker["scatter"] = setup_figure(label)
+    if os.path.isdir(source):  # frame archive
+        index = load_index(source)
+        _worker["read"] = lambda i: archive_frame(source, index, i)
+    else:
+        reader = DeltaReader(source)  # replays onwards from the frame it last read
+        _worker["read"] = lambda i: reader.frame(i)[1:]
+
+
+def render_frame(i: int) -> bytes:
+    """
+    Draws frame i by moving the points of the one scatter artist, returns raw RGB
+    """
+    x, y, values = _worker["read"](i)
+    scatter = _worker["scatter"]
+    scatter.set_offsets(np.column_stack((x, y)))
+    scatter.set_array(np.asarray(values))
+    if len(values):
+        scatter.autoscale()  # colour range of this frame, like a new plot would have
+    fig = _worker["fig"]
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())[:, :, :3].tobytes()
+
+
+def num_frames(source: str) -> int:
+    if os.path.isdir(source):
+        return len(load_index(source)["frames"])
+    return len(DeltaReader(source))
+
+
+def make_animation(
+    label: str, source: str, output: str = "animation.mp4", workers: int = None
+):
+    """
+    Renders every frame of the source across a process pool
+    and streams them in order into ffmpeg, without writing any images
+    """
+    from multiprocessing import Pool
+
+    fig, _ = setup_figure(label)
+    width, height = fig.canvas.get_width_height()
+    plt.close(fig)
+    # raw RGB frames on stdin, encoded the same way as the pngs were
+    command = (
+        f"{ffmpeg} -y -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i -"
+    )
+    command += " -pix_fmt yuv420p -vf scale=trunc(iw/2)*2:trunc(ih/2)*2 -f mp4"
+    encoder = subprocess.Popen(command.split() + [output], stdin=subprocess.PIPE)
+    total = num_frames(source)
+    with Pool(workers, initializer=_init_worker, initargs=(label, source)) as pool:
+        # imap keeps the frame order, while the workers render ahead
+        for i, rgb in enumerate(pool.imap(render_frame, range(total), chunksize=4)):
+            encoder.stdin.write(rgb)
+            print(f"Encoded frame {i} of {total - 1}")
+    encoder.stdin.close()
+    if encoder.wait():
+        raise RuntimeError(f"ffmpeg exited with code {encoder.returncode}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("label", help="colorbar label")
+    parser.add_argument(
+        "source", nargs="?", default="data.bin", help="data.bin or a frame archive"
+    )
+    parser.add_argument("-o", "--output", default="animation.mp4")
+    parser.add_argument("-j", "--workers", help="number of processes", type=int)
+    args = parser.parse_args()
+    make_animation(args.label, args.source, args.output, args.workers)
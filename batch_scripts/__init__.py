@@ -1 +1 @@
-from .. import generate, modify
+from .. import generate, generate_many, modify, modify_sweep
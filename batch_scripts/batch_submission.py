@@ -8,7 +8,7 @@ prop_2 = 10000
 mod_fraction = 0.2
 base_name = "crack"
 
-import sys, os, subprocess, random
+import sys, os, subprocess, random, argparse
 from matplotlib import pyplot as plt
 
 # make sure script is using python37
@@ -19,14 +19,17 @@ if sys.version_info[0] == 3 and sys.version_info[1] < 7:
     print("You need to load the python37 module")
     sys.exit()
 
-slurmhdr = f"""#!/bin/bash
 
-#SBATCH --job-name={base_name}      # job name
+def slurmhdr(jobname=base_name, cores=ncores, mem=30000):
+
+    return f"""#!/bin/bash
+
+#SBATCH --job-name={jobname}      # job name
 #SBATCH --partition=SOE_sills       # partition (queue)
 #SBATCH --account=sills_2
 #SBATCH -t 7-00:00                  # time limit: (D-HH:MM)
-#SBATCH --mem=30000                # total memory
-#SBATCH -n {ncores}                 # number of tasks
+#SBATCH --mem={mem}                # total memory
+#SBATCH -n {cores}                 # number of tasks
 #SBATCH -c 1                        # specify one CPU per task
 
 module purge
@@ -36,26 +39,42 @@ unset SLURM_GTIDS # otherwise Abaqus fails to run
 
 
 shell = lambda x, **kwargs: subprocess.run(x, shell=True, check=True, **kwargs)
-srun = lambda x: shell(f"srun -A sills_2 -p SOE_sills --mem=10000 {x}")
 
 cwd = os.getcwd()
-mydir = "/mnt/beegfs/cf511"
 
 name = f"{base_name}_{size}_{prop_1}_{prop_2}"
 percent = int(mod_fraction * 100)
 heterogenous_name = f"{name}_mod_{percent}p"
 try:
     from .. import generate, modify  # if files are in the same directory
+    from .executors import add_arguments, from_args
 except ImportError:
     sys.path.append("/volume/NFS/cf511/polyxtal2d")
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from homogenous import generate
     from modify import modify  # pull from polyxtal2d folder
+    from executors import add_arguments, from_args
+
+parser = argparse.ArgumentParser()
+add_arguments(parser)
+args = parser.parse_args()
+executor = from_args(args, slurmhdr)
+mydir = executor.scratch  # fast storage the jobs run in
 
 print("Creating microstrcture")
 generate(name, size, prop_1, prop_2, coh_stiffness=2e9, mesh_size=0.11)
-print("Generating Homogenous CAE")
-srun(f"{abqpath}/abaqus cae noGUI={name}.py")
-# we now have a CAE file with built in strength properties
+print("Submitting Homogenous CAE")
+# every stage is a job that starts once the jobs it needs are done,
+# so the script only writes the variants and submits, without waiting on any cae build
+homogenous_cae = executor.submit(
+    name,
+    [("cae", f"{abqpath}/abaqus cae noGUI={name}.py")],
+    cwd,
+    job_name=f"{base_name}-cae",
+    cores=1,
+    mem=10000,
+)
+# the heterogenous cae builds open the CAE file with built in strength properties
 
 mod_seed = random.randint(1000, 9999)  # use same seed for all modifier trials
 
@@ -66,25 +85,48 @@ for prop2 in [10000, 30000, 50000, 70000, 90000]:
     modify(
         name + ".cae", heterogenous_name, mod_fraction, new_prop_2=prop2, seed=mod_seed
     )
-    print("Generating Heterogenous CAE and inp")
-    srun(f"{abqpath}/abaqus cae noGUI={heterogenous_name}.py")
-    with open(heterogenous_name + ".batch", "w") as f:  # write batch file
-        f.write(slurmhdr)  # write header
-        f.write(
-            f"{abqpath}/abaqus job={heterogenous_name} cpus={ncores} mp_mode=mpi scratch=. -interactive\n"
-        )  # run the inp
-        f.write(
-            f"{abqpath}/abaqus python ~/polyxtal2d/post_processing/post_processor.py {heterogenous_name}.odb\n"
-        )  # run the r-curve txt file generator while the files are still on fast storage
-        f.write(
-            f"mv {mydir}/{heterogenous_name} {cwd}\n"
-        )  # move the results back to the directory where this script is called
-
+    print("Submitting Heterogenous CAE and inp")
     shell(f"mkdir {mydir}/{heterogenous_name}")
-    shell(
-        f"mv {heterogenous_name}.* {mydir}/{heterogenous_name}"
-    )  # move all files to beegfs
-    shell(
-        f"sbatch {heterogenous_name}.batch",
-        cwd=f"{mydir}/{heterogenous_name}",
+    cae = executor.submit(
+        heterogenous_name,
+        [
+            ("cae", f"{abqpath}/abaqus cae noGUI={heterogenous_name}.py"),
+            # move all files to beegfs
+            (None, f"mv {heterogenous_name}.* {mydir}/{heterogenous_name}"),
+        ],
+        cwd,
+        job_name=f"{base_name}-cae",
+        after=[homogenous_cae],
+        cores=1,
+        mem=10000,
     )
+    solve = executor.submit(
+        heterogenous_name,
+        [  # run the inp
+            (
+                "solve",
+                f"{abqpath}/abaqus job={heterogenous_name} cpus={ncores} mp_mode=mpi scratch=. -interactive",
+            )
+        ],
+        f"{mydir}/{heterogenous_name}",
+        job_name=base_name,
+        after=[cae],
+    )
+    executor.submit(
+        heterogenous_name,
+        [
+            (  # run the r-curve txt file generator while the files are still on fast storage
+                "post",
+                f"{abqpath}/abaqus python {executor.code_dir}/post_processing/post_processor.py {heterogenous_name}.odb",
+            ),
+            # move the results back to the directory where this script is called
+            (None, f"mv {mydir}/{heterogenous_name} {cwd}"),
+        ],
+        f"{mydir}/{heterogenous_name}",
+        job_name=f"{base_name}-post",
+        after=[solve],
+        cores=1,
+        mem=10000,
+    )
+
+executor.wait()
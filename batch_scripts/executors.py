@@ -0,0 +1,203 @@
+# Where the batch scripts send their Abaqus work. Every stage of a variant is its own job,
+# started once the jobs it needs have finished. SlurmExecutor submits them with sbatch
+# dependencies, LocalExecutor runs the same commands as subprocesses on this machine,
+# a few jobs at a time, so a whole sweep can be run and timed off the cluster.
+# Stub commands can stand in for the stages that need Abaqus, for example
+#   python3 vary_all_params.py --local -j 8 --stub cae="sleep 1" --stub solve="sleep 5"
+import os, subprocess, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+stages = ("cae", "solve", "post")  # the steps that can be stubbed
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+shell = lambda x, **kwargs: subprocess.run(x, shell=True, check=True, **kwargs)
+
+
+class Executor:
+    """
+    Runs the commands of each job. Steps are (stage, command) pairs, stage None
+    for housekeeping like moving results. The commands of a stage with a stub
+    are replaced by the stub, with {name} filled in with the job name
+    """
+
+    scratch = "."  # fast storage the jobs run in
+    code_dir = repo_dir  # where the jobs find this repository
+
+    def __init__(self, stubs: dict = None):
+        self.stubs = stubs or {}
+        unknown = set(self.stubs) - set(stages)
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown}, stubs are for {stages}")
+
+    def commands(self, name: str, steps: list) -> list:
+        commands = []
+        for i, (stage, command) in enumerate(steps):
+            if stage not in self.stubs:
+                commands.append(command)
+            elif i == 0 or steps[i - 1][0] != stage:  # one stub per stage
+                commands.append(self.stubs[stage].format(name=name))
+        return commands
+
+    def job_label(self, name: str, steps: list) -> str:
+        """
+        Returns {name}-{stage}, after the first stage of the job, to name its files
+        """
+        stage = next((stage for stage, command in steps if stage), "job")
+        return f"{name}-{stage}"
+
+    def submit(
+        self,
+        name: str,
+        steps: list,
+        cwd: str,
+        job_name: str = None,
+        after: list = (),
+        **header_options,
+    ):
+        """
+        Queues a job running the steps in order in cwd once every job in after
+        has succeeded, returns a handle to pass as after to the jobs that need it
+        """
+        raise NotImplementedError
+
+    def wait(self):
+        """
+        Waits for the submitted jobs, if this executor runs them itself
+        """
+
+
+class SlurmExecutor(Executor):
+    scratch = "/mnt/beegfs/cf511"
+    code_dir = "~/polyxtal2d"
+
+    def __init__(self, header, stubs: dict = None):
+        """
+        header is a function of the job name and any header options given to submit,
+        returning the top of the batch file
+        """
+        super().__init__(stubs)
+        self.header = header
+
+    def submit(self, name, steps, cwd, job_name=None, after=(), **header_options):
+        batch_filename = self.job_label(name, steps) + ".batch"
+        with open(os.path.join(cwd, batch_filename), "w") as f:
+            f.write(self.header(job_name or name, **header_options))
+            f.write("".join(command + "\n" for command in self.commands(name, steps)))
+        dependency = f" --dependency=afterok:{':'.join(after)}" if after else ""
+        result = shell(
+            f"sbatch --parsable{dependency} {batch_filename}",
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        job_id = result.stdout.strip().split(";")[0]  # id;cluster on multi-cluster
+        print(f"Submitted batch job {job_id}")
+        return job_id
+
+
+class LocalExecutor(Executor):
+    def __init__(self, workers: int = 1, scratch: str = None, stubs: dict = None):
+        """
+        Runs up to workers jobs at once, in directories under scratch.
+        The output of each job goes to local-{name}-{stage}.out in its directory
+        """
+        super().__init__(stubs)
+        self.scratch = os.path.abspath(scratch or "scratch")
+        os.makedirs(self.scratch, exist_ok=True)
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers)  # each thread waits on a subprocess
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def _run_job(self, commands, cwd, log_filename):
+        ts = time.time()
+        with open(os.path.join(cwd, log_filename), "w") as log:
+            for command in commands:
+                shell(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        return time.time() - ts
+
+    def submit(self, name, steps, cwd, job_name=None, after=(), **header_options):
+        """
+        Only hands the job to the pool once the jobs it needs are done,
+        so a waiting job never holds one of the workers
+        """
+        job = Future()
+        label = self.job_label(name, steps)
+        commands = self.commands(name, steps)
+        waiting = [len(after)]  # jobs in after still running
+
+        def start():
+            if any(dependency.exception() for dependency in after):
+                job.set_exception(RuntimeError("a job it needs failed"))
+                return
+            run = self.pool.submit(self._run_job, commands, cwd, f"local-{label}.out")
+            run.add_done_callback(
+                lambda run: job.set_exception(run.exception())
+                if run.exception()
+                else job.set_result(run.result())
+            )
+
+        def dependency_done(dependency):
+            with self.lock:
+                waiting[0] -= 1
+                ready = waiting[0] == 0
+            if ready:
+                start()
+
+        for dependency in after:
+            dependency.add_done_callback(dependency_done)
+        if not after:
+            start()
+        self.jobs.append((label, job))
+        return job
+
+    def wait(self):
+        """
+        Waits for every job and prints how long they took
+        """
+        failed = []
+        for name, job in self.jobs:
+            try:
+                print(f"Finished {name} in {job.result():.1f} s")
+            except Exception as e:
+                print(f"Failed {name}: {e}")
+                failed.append(name)
+        elapsed = time.time() - self.start
+        done = len(self.jobs) - len(failed)
+        print(
+            f"{done} of {len(self.jobs)} jobs in {elapsed:.1f} s with {self.workers}"
+            f" workers, {3600 * done / elapsed:.1f} jobs per hour"
+        )
+        if failed:
+            print(f"Failed: {' '.join(failed)}")
+        self.pool.shutdown()
+
+
+def add_arguments(parser):
+    """
+    Adds the options choosing and configuring the executor to an argument parser
+    """
+    parser.add_argument(
+        "--local",
+        help="run every stage on this machine instead of through slurm",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j", "--workers", help="number of local jobs at once", type=int, default=1
+    )
+    parser.add_argument("--scratch", help="local directory the jobs run in")
+    parser.add_argument(
+        "--stub",
+        help="command to run instead of a stage, as stage=command, {name} is the job name",
+        action="append",
+        default=[],
+        metavar="STAGE=COMMAND",
+    )
+
+
+def from_args(args, header) -> Executor:
+    stubs = dict(stub.split("=", 1) for stub in args.stub)
+    if args.local:
+        return LocalExecutor(args.workers, args.scratch, stubs)
+    return SlurmExecutor(header, stubs=stubs)
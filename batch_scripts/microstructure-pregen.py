@@ -8,8 +8,7 @@ prop_2 = 50000
 mod_fraction = 0.2
 base_name = "pregen"
 
-import sys, os, subprocess, random
-from matplotlib import pyplot as plt
+import sys, os, subprocess, random, argparse
 
 # make sure script is using python37
 if sys.version_info[0] < 3:
@@ -42,19 +41,59 @@ sbatch = lambda x: shell(
 )  # arcane bash bs
 
 cwd = os.getcwd()
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 mydir = "/mnt/beegfs/cf511"
 
 try:
-    from .. import generate, modify  # if files are in the same directory
+    from .. import generate_many  # if files are in the same directory
 except ImportError:
     sys.path.append("/volume/NFS/cf511/polyxtal2d")
-    from homogenous import generate
-    from modify import modify  # pull from polyxtal2d folder)
-
-for i in range(1, 100):  # generate 100 random microstructures
-    seed = random.randint(1000, 9999)  # use same seed for all modifier trials
-    print(f"Generating microstructure with seed {seed}")
-    name = f"size_{size}_seed_{seed}"
-    generate(name, size, prop_1, prop_2, coh_stiffness=1e10, mesh_size=0.11, seed=seed)
-    print("Generating Homogenous CAE")
-    sbatch(f"{abqpath}/abaqus cae noGUI={name}.py")
+    from homogenous import generate_many  # pull from polyxtal2d folder
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "-n", "--number", help="number of random seeds to generate", type=int, default=100
+)
+parser.add_argument(
+    "--seeds", help="specific seeds to generate instead", type=int, nargs="+"
+)
+parser.add_argument("--size", help="Size of the simulation", type=int, default=size)
+parser.add_argument(
+    "-j",
+    "--workers",
+    help="number of worker processes, defaults to all cores",
+    type=int,
+)
+parser.add_argument("-o", "--outdir", help="output directory", default=".")
+parser.add_argument(
+    "--native",
+    help="write .inp files directly instead of submitting CAE jobs",
+    action="store_true",
+)
+args = parser.parse_args()
+
+if args.seeds:
+    seeds = args.seeds
+else:  # generate random microstructures
+    seeds = random.sample(range(1000, 10000), args.number)
+
+timings = generate_many(
+    seeds,
+    args.size,
+    prop_1,
+    prop_2,
+    outdir=args.outdir,
+    workers=args.workers,
+    coh_stiffness=1e10,
+    mesh_size=0.11,
+    native=args.native,
+)
+if not args.native:
+    for seed in sorted(timings):  # only the newly generated ones
+        name = f"size_{args.size}_seed_{seed}"
+        print(f"Generating Homogenous CAE for seed {seed}")
+        # the catalog only lists the CAE file once the build has made it
+        sbatch(
+            f"cd {os.path.abspath(args.outdir)} && {abqpath}/abaqus cae noGUI={name}.py"
+            f" && python3 {repo_dir}/utils/catalog.py add {name}.json"
+        )
@@ -13,10 +13,11 @@ num_replicates = 5
 mod_vals = [0.2, 0.4, 0.6]
 strength_ratios = [0.75, 1.25]
 toughness_ratios = [0.25, 0.5, 0.75, 1.25]
+render = False  # save a png of the modified grains for every variant
+sweep_workers = 4  # processes writing variants of the same microstructure
 
 
-import sys, os, subprocess, random
-from matplotlib import pyplot as plt
+import sys, os, subprocess, random, argparse
 from numpy import format_float_scientific
 
 ffs_wrapper = lambda x: format_float_scientific(x, trim="-").replace(".", "_")
@@ -31,14 +32,19 @@ if sys.version_info[0] == 3 and sys.version_info[1] < 7:
     sys.exit()
 
 try:  # check both paths, one for running on the cluster and one for local coding
-    from . import modify
+    from . import modify_sweep
+    from ..utils.catalog import catalog_name, build_catalog, sample_seeds
+    from .executors import add_arguments, from_args
 
 except ImportError:
     sys.path.append("/volume/NFS/cf511/polyxtal2d")
-    from modify import modify  # pull from polyxtal2d folder
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from modify import modify_sweep  # pull from polyxtal2d folder
+    from utils.catalog import catalog_name, build_catalog, sample_seeds
+    from executors import add_arguments, from_args
 
 
-def slurmhdr(jobname=base_name):
+def slurmhdr(jobname=base_name, cores=ncores, mem=96000):
 
     return f"""#!/bin/bash
 
@@ -46,8 +52,8 @@ def slurmhdr(jobname=base_name):
 #SBATCH --partition=SOE_sills       # partition (queue)
 #SBATCH --account=sills_2
 #SBATCH -t 2-12:00                  # time limit: (D-HH:MM)
-#SBATCH --mem=96000                # total memory
-#SBATCH -n {ncores}                 # number of tasks
+#SBATCH --mem={mem}                # total memory
+#SBATCH -n {cores}                 # number of tasks
 #SBATCH -c 1                        # specify one CPU per task
 
 module purge
@@ -56,28 +62,41 @@ unset SLURM_GTIDS # otherwise Abaqus fails to run
 """
 
 
-mydir = "/mnt/beegfs/cf511"
 shell = lambda x, **kwargs: subprocess.run(x, shell=True, check=True, **kwargs)
 
-
-seed_list = []
-for i in range(num_replicates):
-    cae_found = False
-    while cae_found is False:
-        seed = random.randint(1, 10000)
-        # see if there is an existing cae file
-        cae_file = (
-            f"{vol_sills_path}/pregen/abq2019/size_{size}/size_{size}_seed_{seed}.cae"
-        )
-        if seed in seed_list:  # duplicate seed
-            continue
-        if os.path.isfile(cae_file):  # great, we can us it
+parser = argparse.ArgumentParser()
+add_arguments(parser)
+parser.add_argument(
+    "--pregen",
+    help="pregenerated microstructure library",
+    default=f"{vol_sills_path}/pregen/abq2019/size_{size}",
+)
+args = parser.parse_args()
+executor = from_args(args, slurmhdr)
+mydir = executor.scratch  # fast storage the jobs run in
+code_dir = executor.code_dir
+
+pregen_dir = args.pregen
+catalog_file = f"{pregen_dir}/{catalog_name}"
+if not os.path.isfile(catalog_file):  # older library, index it once
+    build_catalog(pregen_dir)
+seed_list, missing = [], []
+while len(seed_list) < num_replicates:  # the catalog can be behind the files on disk
+    for seed in sample_seeds(
+        catalog_file,
+        num_replicates - len(seed_list),
+        size=size,
+        model="cae",
+        exclude=seed_list + missing,
+    ):
+        if os.path.isfile(f"{pregen_dir}/size_{size}_seed_{seed}.cae"):
             seed_list.append(seed)
-            cae_found = True
-        else:  # nope, try again
-            continue
+        else:
+            print(f"Skipping seed {seed}, its cae file is missing")
+            missing.append(seed)
 print(f"Using seeds: {seed_list}")
 
+jobs = []  # [(mod, strength_ratio, toughness_ratio, seed, name)] in submission order
 for mod in mod_vals:
     if not os.path.exists(str(mod)):
         os.mkdir(str(mod))
@@ -90,10 +109,6 @@ for mod in mod_vals:
             if not os.path.exists(f"{mod}/{strength_ratio}/{toughness_ratio}"):
                 os.mkdir(f"{mod}/{strength_ratio}/{toughness_ratio}")
             for seed in seed_list:
-
-                # pregenerated cae file
-                cae_file = f"{vol_sills_path}/pregen/abq2019/size_{size}/size_{size}_seed_{seed}.cae"
-
                 # new name for the output files
                 name = (
                     f"mod_{ffs_wrapper(mod)}_"
@@ -101,59 +116,85 @@ for mod in mod_vals:
                     f"tough_ratio_{ffs_wrapper(toughness_ratio)}_"
                     f"seed_{seed}"
                 )
-
-                plt.close()
-                plt.figure()  # new figure
-                # do the modification
-                modify(
-                    cae_file,
-                    name,
-                    mod,
-                    seed,
-                    viscosity=0.002,
-                    new_prop_1=base_prop,
-                    new_prop_2=base_prop * strength_ratio,
-                    new_crit_disp_1=base_crit_disp,
-                    # \delta_m = \delta_0 \times \frac{\bar \Gamma}{\bar \sigma}
-                    new_crit_disp_2=base_crit_disp * toughness_ratio / strength_ratio,
-                )
-
-                # final directory name
-                dir_name = (
-                    f"{os.getcwd()}/{mod}/{strength_ratio}/{toughness_ratio}/"
-                    f"mod_{mod}_strength-ratio_{strength_ratio}_toughness-ratio_{toughness_ratio}seed_{seed}"
-                )
-                # write sbatch file
-                with open(f"{name}.batch", "w") as f:
-                    f.write(slurmhdr(str(job_id)))
-                    f.write(f"{abqpath}/abaqus cae noGUI={name}.py\n")
-                    f.write(
-                        "python3 ~/polyxtal2d/utils/max_increment.py"
-                        f" {name} {I_0} {I_R}\n"
-                    )  # run script that modifies input file
-                    f.write(
-                        f"{abqpath}/abaqus job={name} cpus={ncores} mp_mode=mpi"
-                        ' memory="96000 mb" scratch=. -interactive\n'
-                    )
-                    f.write(
-                        f"{abqpath}/abaqus python"
-                        f" ~/polyxtal2d/post_processing/post_processor.py {name}.odb\n"
-                    )
-                    f.write(
-                        f"python3 ~/polyxtal2d/post_processing/node_lut.py {name}.inp\n"
-                    )
-                    f.write(
-                        f"mv {mydir}/{name} {dir_name}\n"
-                    )  # move the results back to the directory where this script is called
-
-                shell(f"mkdir {mydir}/{name}")
-                shell(f"mv {name}.* {mydir}/{name}")
-                print(f"Submitted job: {name}")
-                shell(
-                    f"sbatch {name}.batch",
-                    cwd=f"{mydir}/{name}",
-                )
-                print(
-                    f"Submitted job {job_id} of {num_replicates*len(mod_vals)*len(strength_ratios)*len(toughness_ratios)}"
-                )
-                job_id += 1
+                jobs.append((mod, strength_ratio, toughness_ratio, seed, name))
+
+# do the modification, loading each pregenerated microstructure only once
+for seed in seed_list:
+    modify_sweep(
+        f"{pregen_dir}/size_{size}_seed_{seed}.cae",  # pregenerated cae file
+        [
+            dict(
+                name=name,
+                mod_fraction=mod,
+                seed=seed,
+                viscosity=0.002,
+                new_prop_1=base_prop,
+                new_prop_2=base_prop * strength_ratio,
+                new_crit_disp_1=base_crit_disp,
+                # \delta_m = \delta_0 \times \frac{\bar \Gamma}{\bar \sigma}
+                new_crit_disp_2=base_crit_disp * toughness_ratio / strength_ratio,
+            )
+            for mod, strength_ratio, toughness_ratio, job_seed, name in jobs
+            if job_seed == seed
+        ],
+        render=render,
+        workers=sweep_workers,
+    )
+
+for mod, strength_ratio, toughness_ratio, seed, name in jobs:
+    # final directory name
+    dir_name = (
+        f"{os.getcwd()}/{mod}/{strength_ratio}/{toughness_ratio}/"
+        f"mod_{mod}_strength-ratio_{strength_ratio}_toughness-ratio_{toughness_ratio}seed_{seed}"
+    )
+    cae_steps = [
+        ("cae", f"{abqpath}/abaqus cae noGUI={name}.py"),
+        # run script that modifies input file
+        ("cae", f"python3 {code_dir}/utils/max_increment.py {name} {I_0} {I_R}"),
+    ]
+    solve_steps = [
+        (
+            "solve",
+            f"{abqpath}/abaqus job={name} cpus={ncores} mp_mode=mpi"
+            ' memory="96000 mb" scratch=. -interactive',
+        )
+    ]
+    post_steps = [
+        (
+            "post",
+            f"{abqpath}/abaqus python"
+            f" {code_dir}/post_processing/post_processor.py {name}.odb",
+        ),
+        (  # variants of the same seed share one mesh topology
+            "post",
+            f"python3 {code_dir}/post_processing/node_lut.py {name}.inp"
+            f" --cache {mydir}/topology_cache",
+        ),
+        # move the results back to the directory where this script is called
+        (None, f"mv {mydir}/{name} {dir_name}"),
+    ]
+
+    shell(f"mkdir {mydir}/{name}")
+    shell(f"mv {name}.* {mydir}/{name}")
+    print(f"Submitted job: {name}")
+    # each stage is its own job, so every cae build runs at once on a single core
+    # and each solve starts as soon as its own input file is written
+    cwd = f"{mydir}/{name}"
+    cae = executor.submit(
+        name, cae_steps, cwd, job_name=f"{job_id}-cae", cores=1, mem=10000
+    )
+    solve = executor.submit(name, solve_steps, cwd, job_name=str(job_id), after=[cae])
+    executor.submit(
+        name,
+        post_steps,
+        cwd,
+        job_name=f"{job_id}-post",
+        after=[solve],
+        cores=1,
+        mem=10000,
+    )
+    print(
+        f"Submitted job {job_id} of {num_replicates*len(mod_vals)*len(strength_ratios)*len(toughness_ratios)}"
+    )
+    job_id += 1
+executor.wait()
@@ -13,7 +13,7 @@ from utils.coh_surf_macros import (
     property_assignment,
     section,
     mesh,
-    polygon_writer,
+    sketch_writer,
     section,
     set_maker,
     surface_maker,
@@ -22,10 +22,12 @@ from utils.coh_surf_macros import (
     general_interaction,
     top_displacement,
     write_inp,
+    native_inp,
 )
-from utils import length_scale, midpoints, region_sanity, timeit, add_crack
+from utils import length_scale, midpoints, region_sanity, timeit, add_crack, centroid
 from matplotlib.patches import Rectangle
 from utils.shared_config import grain_color, distance
+from utils.microstructure import save_microstructure
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 # suppress divide-by-zero warning when calculating a slope
@@ -44,6 +46,7 @@ def generate(
     coh_stiffness=1e9,
     check_ls: bool = False,
     standalone: bool = False,
+    native: bool = False,
 ):
 
     if not seed:  # no seed specified
@@ -78,30 +81,19 @@ def generate(
     # plt.ylim(0, size)
     # plt.show()
 
-    from utils.bisector_scaling import scale as bisector_scale
+    from utils.bisector_scaling import scale_many
     from collections import defaultdict
 
-    vertex_array = defaultdict(list)  # dict of lists
     grain_array = defaultdict(list)
     grain_centers = {}
+    valid_regions = {}  # {grain_id: region}
     for r_idx, region in enumerate(vor.regions):
         if (
             not -1 in region
             # and len(region) == 6 # only want hexagons
             and region_sanity(region, size, size, vor.vertices)
         ):  # bounded with 6 sides
-            for i in range(2, len(region) + 2):
-                i = i % len(region)  # wrap around
-                vertex_id = region[i - 1]
-                p1 = vor.vertices[region[i - 2]]  # neighboring point on the grain
-                p2 = vor.vertices[vertex_id]  # point we're interested in
-                p3 = vor.vertices[region[i]]  # other neighboring point
-                new_point = bisector_scale(p1, p2, p3, distance)
-                vertex_array[vertex_id].append(
-                    new_point
-                )  # {vertex_id:{grain_id: [new_point.x, new_point.y]}}
-                grain_array[r_idx].append(new_point)  # {grain_id:[point1]}
-            # plt.fill(*zip(*grain_array[r_idx]))  # draw the scaled polygons
+            valid_regions[r_idx] = region
             centerx = sum([vor.vertices[p][0] for p in region]) / 6
             centery = sum([vor.vertices[p][1] for p in region]) / 6
             grain_centers[r_idx] = [centerx, centery]
@@ -109,6 +101,28 @@ def generate(
             # plt.text(centerx, centery, str(r_idx), size=120 / size)
             # label the grain, shrink text size as the sim size grows
 
+    # scale every corner of every grain at once
+    # each corner is offset along the bisector of its two neighboring points on the grain,
+    # starting from the second corner of the region and wrapping around to the first
+    prev_ids, curr_ids, next_ids, offsets = [], [], [], [0]
+    for region in valid_regions.values():
+        prev_ids.extend(region)
+        curr_ids.extend(np.roll(region, -1))
+        next_ids.extend(np.roll(region, -2))
+        offsets.append(offsets[-1] + len(region))
+    new_points = scale_many(
+        vor.vertices[np.array(prev_ids, dtype=int)],
+        vor.vertices[np.array(curr_ids, dtype=int)],
+        vor.vertices[np.array(next_ids, dtype=int)],
+        distance,
+    ).tolist()
+    for i, r_idx in enumerate(valid_regions):
+        if offsets[i] != offsets[i + 1]:
+            grain_array[r_idx] = new_points[
+                offsets[i] : offsets[i + 1]
+            ]  # {grain_id:[point1]}
+            # plt.fill(*zip(*grain_array[r_idx]))  # draw the scaled polygons
+
     print(f"Number of Grains: {len(grain_array)}")
     area_per_grain = size * size / len(grain_array)
     print(f"Average area per grain: {area_per_grain}")
@@ -137,57 +151,90 @@ def generate(
         grain_array, grain_centers, x_max, y_min, y_max
     )
 
-    with open(f"{name}.py", "w") as file:
-        header(file)
-        for grain in grain_array.values():
-            polygon_writer(file, grain)
-
-        process_lines(file)
-        section(file, "Alumina", 370e9, 0.25)
-        mesh(file, seed_size=mesh_size)
-        make_instance(file)
-        for g in grain_array:
-            mps = midpoints(grain_array[g])
-            surface_maker(file, f"Surf-{g}", mps)
-        interaction_property(
-            file,
-            "Prop-1",
-            damagevalue=prop_1,
-            plastic_displacement=plastic_displacement,
-            viscosity=1e-3,
-            coh_stiffness=coh_stiffness,
-        )
-        ls_1 = length_scale(
-            strength=prop_1,
-            mesh_size=mesh_size,
-            crack_length=x_max,
-            crit_displacement=plastic_displacement,
-            stiffness=coh_stiffness,
-            scientific=True,
-            check=check_ls,
-        )
-        interaction_property(
-            file,
-            "Prop-2",
-            damagevalue=prop_2,
-            plastic_displacement=plastic_displacement,
-            viscosity=1e-3,
-            coh_stiffness=coh_stiffness,
-        )
-        ls_2 = length_scale(
-            strength=prop_2,
-            crit_displacement=plastic_displacement,
-            stiffness=coh_stiffness,
-            scientific=True,
-        )
-        effective_ls = 370e9 / (2 * (coh_stiffness))
-        print(f"Effective length scale: {effective_ls}")
-        general_interaction(file, "General", "Prop-1")
-        encastre(file, "BC-1", threshold=2)
-        top_displacement(file, "BC-2", u2=0.001, threshold=size - 2)
-        if standalone:
-            write_inp(file, name)
-        file.write(f"mdb.saveAs('{name}')")  # save cae
+    # grain adjacency from the voronoi ridges, in CSR format indexed by grain id
+    ridge_regions = vor.point_region[vor.ridge_points]  # region on each side
+    ridge_regions = ridge_regions[
+        np.isin(ridge_regions, list(grain_array)).all(axis=1)
+    ]  # only keep ridges between two grains
+    pairs = np.concatenate((ridge_regions, ridge_regions[:, ::-1]))  # both ways
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    neighbor_indptr = np.searchsorted(pairs[:, 0], np.arange(len(vor.regions) + 1))
+    neighbor_indices = pairs[:, 1]
+
+    ls_1 = length_scale(
+        strength=prop_1,
+        mesh_size=mesh_size,
+        crack_length=x_max,
+        crit_displacement=plastic_displacement,
+        stiffness=coh_stiffness,
+        scientific=True,
+        check=check_ls,
+    )
+    ls_2 = length_scale(
+        strength=prop_2,
+        crit_displacement=plastic_displacement,
+        stiffness=coh_stiffness,
+        scientific=True,
+    )
+    effective_ls = 370e9 / (2 * (coh_stiffness))
+    print(f"Effective length scale: {effective_ls}")
+
+    if native:  # mesh in python and write the input file directly, no CAE needed
+        with open(f"{name}.inp", "w") as file:
+            native_inp(
+                file,
+                name,
+                grain_array,
+                {
+                    "Prop-1": (prop_1, plastic_displacement),
+                    "Prop-2": (prop_2, plastic_displacement),
+                },
+                seed_size=mesh_size,
+                coh_stiffness=coh_stiffness,
+                viscosity=1e-3,
+                bottom_threshold=2,
+                top_threshold=size - 2,
+                u2=0.001,
+            )
+    else:
+        with open(f"{name}.py", "w") as file:
+            header(file)
+            n_lines = sketch_writer(file, grain_array.values())
+            print(f"Sketch entities: {len(grain_array)} grains, {n_lines} lines")
+
+            process_lines(file)
+            section(file, "Alumina", 370e9, 0.25)
+            mesh(file, seed_size=mesh_size)
+            make_instance(file)
+            for g in grain_array:
+                mps = midpoints(grain_array[g])
+                surface_maker(file, f"Surf-{g}", mps)
+            interaction_property(
+                file,
+                "Prop-1",
+                damagevalue=prop_1,
+                plastic_displacement=plastic_displacement,
+                viscosity=1e-3,
+                coh_stiffness=coh_stiffness,
+            )
+            interaction_property(
+                file,
+                "Prop-2",
+                damagevalue=prop_2,
+                plastic_displacement=plastic_displacement,
+                viscosity=1e-3,
+                coh_stiffness=coh_stiffness,
+            )
+            general_interaction(file, "General", "Prop-1")
+            # the grain centroids are inside the faces, and also decide which are on the edges
+            centroids = [centroid(grain) for grain in grain_array.values()]
+            encastre(file, "BC-1", points=[c for c in centroids if c[1] < 2])
+            top_displacement(
+                file, "BC-2", u2=0.001, points=[c for c in centroids if c[1] > size - 2]
+            )
+            if standalone:
+                write_inp(file, name)
+            file.write(f"mdb.saveAs('{name}')")  # save cae
 
     # title = f"Seed: {seed}, Prop-1: {prop_1},  Prop-2: {prop_2}"
     # plt.title(title)
@@ -235,7 +282,99 @@ def generate(
     data["grain_array"] = grain_array
     data["grain_centers"] = grain_centers
     data["vor_regions_length"] = len(vor.regions)
-    json.dump(data, open(f"{name}.json", "w"))
+    data["neighbor_indptr"] = neighbor_indptr.tolist()
+    data["neighbor_indices"] = neighbor_indices.tolist()
+    save_microstructure(f"{name}.npz", data)  # fast to load
+    json.dump(data, open(f"{name}.json", "w"))  # human readable export
+
+
+def _pregen_worker(name: str, size: int, outdir: str, kwargs: dict) -> float:
+    """
+    Runs generate in a scratch directory and moves the results into outdir when finished,
+    so an interrupted worker never leaves partial files behind. Returns the runtime in seconds
+    """
+    import tempfile, time
+
+    plt.switch_backend("Agg")
+    plt.close("all")  # workers are reused, so don't draw on the last seed's figure
+    plt.figure()
+    ts = time.time()
+    with tempfile.TemporaryDirectory(dir=outdir) as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)  # each worker is its own process, so this is safe
+        try:
+            generate(name, size, **kwargs)
+        finally:
+            os.chdir(cwd)
+            plt.close("all")
+        # the json file goes last since it marks a finished structure
+        for file in sorted(os.listdir(tmpdir), key=lambda f: f.endswith(".json")):
+            os.replace(os.path.join(tmpdir, file), os.path.join(outdir, file))
+    return time.time() - ts
+
+
+def generate_many(
+    seeds: list,
+    size: int,
+    prop_1: float = 50000,
+    prop_2: float = 50000,
+    outdir: str = ".",
+    workers: int = None,
+    name_format: str = "size_{size}_seed_{seed}",
+    catalog: bool = True,
+    **kwargs,
+) -> dict:
+    """
+    Generates one microstructure per seed, spread across a process pool.
+    Seeds that already have a json file in outdir are skipped,
+    and new structures are added to the catalog in outdir.
+    A CAE file is only cataloged once its build runs catalog.py add.
+    Extra keyword arguments are passed on to generate.
+    Returns {seed: runtime in seconds} for the newly generated structures
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from utils.catalog import catalog_name, catalog_entry, add_to_catalog
+
+    outdir = os.path.abspath(outdir)
+    os.makedirs(outdir, exist_ok=True)
+    todo = {}  # {seed: name}
+    for seed in seeds:
+        name = name_format.format(size=size, seed=seed)
+        if os.path.isfile(os.path.join(outdir, f"{name}.json")):
+            print(f"Skipping seed {seed}, {name} already exists")
+        else:
+            todo[seed] = name
+
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                _pregen_worker,
+                name,
+                size,
+                outdir,
+                dict(prop_1=prop_1, prop_2=prop_2, seed=seed, **kwargs),
+            ): seed
+            for seed, name in todo.items()
+        }
+        for future in as_completed(futures):
+            seed = futures[future]
+            try:
+                timings[seed] = future.result()
+                print(f"Seed {seed} finished in {timings[seed]:.2f} s")
+                if catalog:
+                    add_to_catalog(
+                        os.path.join(outdir, catalog_name),
+                        [catalog_entry(os.path.join(outdir, f"{todo[seed]}.json"))],
+                    )
+            except Exception as e:  # don't lose the rest of the batch
+                print(f"Seed {seed} failed: {e!r}")
+    if timings:
+        print(
+            f"Generated {len(timings)} of {len(todo)} structures, "
+            f"average {sum(timings.values()) / len(timings):.2f} s per seed"
+        )
+    return timings
 
 
 if __name__ == "__main__":  # running standalone, not as a function, so take arguments
@@ -258,6 +397,11 @@ if __name__ == "__main__":  # running standalone, not as a function, so take arg
         help="Specify the seed value used to initialize the rng",
         type=int,
     )
+    parser.add_argument(
+        "--native",
+        help="Mesh in python and write the .inp directly instead of a CAE script",
+        action="store_true",
+    )
     args = parser.parse_args()
     name = args.name
     size = args.size
@@ -269,4 +413,4 @@ if __name__ == "__main__":  # running standalone, not as a function, so take arg
     else:  # no seed specified
         seed = None
 
-    generate(name, size, prop_1, prop_2, seed=seed)
+    generate(name, size, prop_1, prop_2, seed=seed, native=args.native)
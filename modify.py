@@ -1,14 +1,51 @@
-import json, random, argparse
+import json, random, argparse, os
 from utils import timeit
 from matplotlib import pyplot as plt
 from scipy.spatial import Delaunay
 from utils import *
 from utils.coh_surf_macros import *
+from utils.microstructure import load_microstructure
 import numpy as np
 from matplotlib import cm
 from utils.shared_config import grain_color, modifier_color
 
 
+def load_base(cae_filename: str) -> dict:
+    """
+    Loads the microstructure behind a homogenous CAE file from the npz file,
+    or the json file if there isn't one, along with its grain adjacency in CSR format
+    """
+    npz_filename = cae_filename.replace(".cae", ".npz")
+    if os.path.isfile(npz_filename):  # binary format, much faster to load
+        json_data = load_microstructure(npz_filename)
+    else:
+        json_filename = cae_filename.replace(".cae", ".json")
+        with open(json_filename, "r") as json_file:
+            json_data = json.load(json_file)
+        keyint = lambda dict_: {
+            int(k): v for k, v in dict_.items()
+        }  # turns all keys into ints since the json process turns everything into strings
+        json_data["grain_array"] = keyint(json_data["grain_array"])
+        json_data["grain_centers"] = keyint(json_data["grain_centers"])
+
+    if "neighbor_indptr" in json_data:  # grain adjacency saved by generate
+        json_data["neighbor_indptr"] = np.asarray(json_data["neighbor_indptr"])
+        json_data["neighbor_indices"] = np.asarray(json_data["neighbor_indices"])
+    else:  # older files, triangulate the grain centers instead
+        indexed = []
+        for i in range(json_data["vor_regions_length"]):
+            c = json_data["grain_centers"].get(i, [0, 0])  # center of grain with id i,
+            # and if empty (invalid region, etc), then use a default of [0,0]
+            indexed.append(c)
+            # and add it to a new array, where the index of the list aligns with the grain id
+
+        (
+            json_data["neighbor_indptr"],
+            json_data["neighbor_indices"],
+        ) = Delaunay(indexed).vertex_neighbor_vertices
+    return json_data
+
+
 @timeit
 def modify(
     cae_filename: str,
@@ -21,38 +58,70 @@ def modify(
     new_crit_disp_2: float = None,
     viscosity: float = 1e-3,
     check_ls: bool = False,
+    native: bool = False,
 ):
     """
     Creates a python script to modify the homogenous CAE file,
-    using microstructure information from a json file
+    using microstructure information from the npz file, or the json file if there isn't one.
+    With native=True the input file is written directly instead,
+    and the cae file only needs to exist as far as finding the microstructure file.
+    """
+    modify_variant(
+        load_base(cae_filename),
+        cae_filename,
+        name,
+        mod_fraction,
+        seed,
+        new_prop_1=new_prop_1,
+        new_prop_2=new_prop_2,
+        new_crit_disp_1=new_crit_disp_1,
+        new_crit_disp_2=new_crit_disp_2,
+        viscosity=viscosity,
+        check_ls=check_ls,
+        native=native,
+    )
+
+
+def modify_variant(
+    base: dict,
+    cae_filename: str,
+    name: str,
+    mod_fraction: float,
+    seed: int = None,
+    new_prop_1: float = None,
+    new_prop_2: float = None,
+    new_crit_disp_1: float = None,
+    new_crit_disp_2: float = None,
+    viscosity: float = 1e-3,
+    check_ls: bool = False,
+    native: bool = False,
+    render: bool = True,
+    mesh_sections: str = None,
+):
+    """
+    Writes one variant of a base microstructure already loaded with load_base, see modify.
+    render=False skips the png, and mesh_sections from native_mesh_sections skips
+    meshing again in native mode
     """
     if mod_fraction < 0 or mod_fraction > 1:
         raise ValueError("Mod fraction must be between 0 and 1")
-    #####################################
-    # Load the data from the json file #
-    #####################################
-    json_filename = cae_filename.replace(".cae", ".json")
-    with open(json_filename, "r") as json_file:
-        json_data = json.load(json_file)
-        size = json_data["size"]  # type: float
-        prop_1 = json_data["prop_1"]  # type: float
-        prop_2 = json_data["prop_2"]  # type: float
-        keyint = lambda dict_: {
-            int(k): v for k, v in dict_.items()
-        }  # turns all keys into ints since the json process turns everything into strings
-        old_crit_disp = json_data["plastic_displacement"]  # type: float
-        mesh_size = json_data["mesh_size"]  # type: float
-        coh_stiffness = json_data["coh_stiffness"]  # type: float
-        grain_array = json_data["grain_array"]
-        grain_array = keyint(grain_array)  # type: dict[int, list[list[float]]]
-        grain_centers = json_data["grain_centers"]
-        grain_centers = keyint(grain_centers)  # type: dict[int, list[float]]
-        vor_regions_length = json_data["vor_regions_length"]  # type:int
+    size = base["size"]  # type: float
+    prop_1 = base["prop_1"]  # type: float
+    prop_2 = base["prop_2"]  # type: float
+    old_crit_disp = base["plastic_displacement"]  # type: float
+    mesh_size = base["mesh_size"]  # type: float
+    coh_stiffness = base["coh_stiffness"]  # type: float
+    grain_array = base["grain_array"]  # type: dict[int, list[list[float]]]
+    grain_centers = base["grain_centers"]  # type: dict[int, list[float]]
+    # array of nearest neighbor relations in CSR format
+    indptr = base["neighbor_indptr"]
+    indices = base["neighbor_indices"]
     ##############################
     # Plot all grains first
     ##############################
-    for value in grain_array.values():
-        plt.fill(*zip(*value), color=grain_color, ls="")  # plot the grains
+    if render:
+        for value in grain_array.values():
+            plt.fill(*zip(*value), color=grain_color, ls="")  # plot the grains
 
     #####################################
     # Select chosen grains using new seed
@@ -77,100 +146,116 @@ def modify(
             ):  # Don't add weaker modifiers if the grains are near the top or bottom
                 pass
             else:
-                plt.fill(
-                    *zip(*grain_array[g]), color=modifier_color, fill=False
-                )  # plot border of modified gran
+                if render:
+                    plt.fill(
+                        *zip(*grain_array[g]), color=modifier_color, fill=False
+                    )  # plot border of modified gran
 
                 chosen_grains.append(g)
 
-    indexed = []
-    for i in range(vor_regions_length):
-        c = grain_centers.get(i, [0, 0])  # get the center of grain with id i,
-        # and if empty (invalid region, etc), then use a default of [0,0]
-        indexed.append(c)
-        # and add it to a new array, where the index of the list aligns with the grain id
+    # modify critical displacement
+    if new_crit_disp_1:
+        crit_disp_1 = new_crit_disp_1
+    else:
+        crit_disp_1 = old_crit_disp
+    if new_crit_disp_2:
+        crit_disp_2 = new_crit_disp_2
+    else:
+        crit_disp_2 = old_crit_disp
+    if new_prop_1:  # override property from json file
+        prop_1 = new_prop_1
+    if new_prop_2:  # override property from json file
+        prop_2 = new_prop_2
 
-    indptr, indices = Delaunay(indexed).vertex_neighbor_vertices
-    # array of nearest neighbor relations, needed for later
+    ls_1 = length_scale(
+        strength=prop_1,
+        mesh_size=mesh_size,
+        crit_displacement=crit_disp_1,
+        stiffness=coh_stiffness,
+        scientific=True,
+        check=check_ls,
+    )
+    ls_2 = length_scale(
+        strength=prop_2,
+        crit_displacement=crit_disp_2,
+        stiffness=coh_stiffness,
+        scientific=True,
+    )
+
+    assignments = []  # [(surf_1, surf_2, prop_name)]
+    for c_idx in chosen_grains:
+        neighbors = indices[indptr[c_idx] : indptr[c_idx + 1]]
+        for neighbor in neighbors:
+            # the crack and the dummy points from older files aren't grains
+            if neighbor in grain_array:
+                assignments.append((f"Surf-{c_idx}", f"Surf-{neighbor}", "Prop-2"))
 
     #####################################
     # write the result to file
     #####################################
 
-    with open(f"{name}.py", "w") as file:
-        file.write("from abaqusConstants import *\n")
-        file.write(f"openMdb('{cae_filename}')\n")
-
-        # modify critical displacement
-        if new_crit_disp_1:
-            crit_disp_1 = new_crit_disp_1
-        else:
-            crit_disp_1 = old_crit_disp
-        if new_crit_disp_2:
-            crit_disp_2 = new_crit_disp_2
-        else:
-            crit_disp_2 = old_crit_disp
-
-        if new_prop_1:  # override property from json file
-            prop_1 = new_prop_1
-            if new_crit_disp_1:  # override critical displacement from json file
-                crit_disp_1 = new_crit_disp_1
-            interaction_property(  # edit the interaction property
-                file,
-                "Prop-1",
-                damagevalue=prop_1,
-                plastic_displacement=crit_disp_1,
-                coh_stiffness=coh_stiffness,
-                viscosity=viscosity,
-            )
-        if new_prop_2:  # override property from json file
-            prop_2 = new_prop_2
-            interaction_property(  # edit the interaction property
+    if native:  # write the whole input file directly, no CAE needed
+        with open(f"{name}.inp", "w") as file:
+            native_inp(
                 file,
-                "Prop-2",
-                damagevalue=prop_2,
-                plastic_displacement=crit_disp_2,
+                name,
+                grain_array,
+                {
+                    "Prop-1": (prop_1, crit_disp_1),
+                    "Prop-2": (prop_2, crit_disp_2),
+                },
+                assignments,
+                seed_size=mesh_size,
                 coh_stiffness=coh_stiffness,
                 viscosity=viscosity,
+                bottom_threshold=2,
+                top_threshold=size - 2,
+                mesh_sections=mesh_sections,
             )
-        ls_1 = length_scale(
-            strength=prop_1,
-            mesh_size=mesh_size,
-            crit_displacement=crit_disp_1,
-            stiffness=coh_stiffness,
-            scientific=True,
-            check=check_ls,
-        )
-        ls_2 = length_scale(
-            strength=prop_2,
-            crit_displacement=crit_disp_2,
-            stiffness=coh_stiffness,
-            scientific=True,
+    else:
+        with open(f"{name}.py", "w") as file:
+            file.write("from abaqusConstants import *\n")
+            file.write(f"openMdb('{cae_filename}')\n")
+
+            # edit an interaction property when its strength or critical displacement
+            # changes, so the model matches the native input file
+            if new_prop_1 or new_crit_disp_1:
+                interaction_property(
+                    file,
+                    "Prop-1",
+                    damagevalue=prop_1,
+                    plastic_displacement=crit_disp_1,
+                    coh_stiffness=coh_stiffness,
+                    viscosity=viscosity,
+                )
+            if new_prop_2 or new_crit_disp_2:
+                interaction_property(
+                    file,
+                    "Prop-2",
+                    damagevalue=prop_2,
+                    plastic_displacement=crit_disp_2,
+                    coh_stiffness=coh_stiffness,
+                    viscosity=viscosity,
+                )
+            property_assignments(file, "General", assignments)
+            write_inp(file, name)
+
+    if render:
+        plt.axis("square")
+        plt.xlim(0, size)
+        plt.ylim(0, size)
+        notetext = (
+            f"Seed: {seed}\n"
+            + "Strengths:\n"
+            + f"  Prop-1: {prop_1:.2E}\n"
+            + f"  Prop-2: {prop_2:.2E}\n"
+            + "Length Scales:\n"
+            + f"  Prop-1: {ls_1}\n"
+            + f"  Prop-2: {ls_2}"
         )
-        for c_idx in chosen_grains:
-            neighbors = indices[indptr[c_idx] : indptr[c_idx + 1]]
-            for neighbor in neighbors:
-                if neighbor != 0:
-                    property_assignment(
-                        file, "General", "Prop-2", f"Surf-{c_idx}", f"Surf-{neighbor}"
-                    )
-        write_inp(file, name)
-
-    plt.axis("square")
-    plt.xlim(0, size)
-    plt.ylim(0, size)
-    notetext = (
-        f"Seed: {seed}\n"
-        + "Strengths:\n"
-        + f"  Prop-1: {prop_1:.2E}\n"
-        + f"  Prop-2: {prop_2:.2E}\n"
-        + "Length Scales:\n"
-        + f"  Prop-1: {ls_1}\n"
-        + f"  Prop-2: {ls_2}"
-    )
-    plt.gcf().text(0.05, 0.4, notetext, fontsize=8)
-    plt.gca().set_axis_off()  # hide the axes
-    plt.savefig(f"{name}.png", bbox_inches="tight", dpi=20 * size)
+        plt.gcf().text(0.05, 0.4, notetext, fontsize=8)
+        plt.gca().set_axis_off()  # hide the axes
+        plt.savefig(f"{name}.png", bbox_inches="tight", dpi=20 * size)
 
     data = {
         "prop_1": prop_1,
@@ -184,6 +269,66 @@ def modify(
     json.dump(data, open(f"{name}.json", "w"))
 
 
+_sweep_state = {}  # base microstructure shared with the pool workers
+
+
+def _sweep_init(*args):
+    plt.switch_backend("Agg")
+    _sweep_state["args"] = args
+
+
+def _sweep_variant(variant: dict, *args):
+    base, cae_filename, native, render, mesh_sections = args or _sweep_state["args"]
+    if render:
+        plt.figure()  # new figure so nothing carries over between variants
+    modify_variant(
+        base,
+        cae_filename,
+        native=native,
+        render=render,
+        mesh_sections=mesh_sections,
+        **variant,
+    )
+    if render:
+        plt.close()
+
+
+@timeit
+def modify_sweep(
+    cae_filename: str,
+    variants: list,
+    native: bool = False,
+    render: bool = False,
+    workers: int = None,
+):
+    """
+    Writes every variant of one base microstructure from a single load.
+    Each variant is a dict of modify arguments, at least name and mod_fraction.
+    The neighbor graph, and the mesh in native mode, are only computed once.
+    If workers is set the variants are split across a process pool
+    """
+    base = load_base(cae_filename)
+    mesh_sections = None
+    if native:
+        mesh_sections = native_mesh_sections(
+            base["grain_array"],
+            seed_size=base["mesh_size"],
+            bottom_threshold=2,
+            top_threshold=base["size"] - 2,
+        )
+    args = (base, cae_filename, native, render, mesh_sections)
+    if workers:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            workers, initializer=_sweep_init, initargs=args
+        ) as pool:
+            list(pool.map(_sweep_variant, variants))  # raise any errors
+    else:
+        for variant in variants:
+            _sweep_variant(variant, *args)
+
+
 if __name__ == "__main__":  # running standalone, not as a function, so take arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("name", help="output name")
@@ -199,6 +344,11 @@ if __name__ == "__main__":  # running standalone, not as a function, so take arg
         help="New seed for the rng",
         type=int,
     )
+    parser.add_argument(
+        "--native",
+        help="Write the .inp directly instead of a CAE script",
+        action="store_true",
+    )
     args = parser.parse_args()
     name = args.name
     cae_filename = args.cae
@@ -212,4 +362,4 @@ if __name__ == "__main__":  # running standalone, not as a function, so take arg
     else:  # no seed specified
         new_seed = None
 
-    modify(cae_filename, name, fraction, new_seed)
+    modify(cae_filename, name, fraction, new_seed, native=args.native)
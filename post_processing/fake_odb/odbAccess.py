@@ -0,0 +1,175 @@
+# Stand-in for the Abaqus odbAccess module that serves synthetic frames,
+# so the post processing scripts can be run and checked without Abaqus.
+# Run with PYTHONPATH=post_processing/fake_odb python3 post_processor.py {name}.odb
+# The odb file itself doesn't need to exist, only the json file written by modify.
+# A crack runs along the middle of a square sample, reaching tip_end at the last frame
+import numpy as np
+from collections import OrderedDict
+
+size = 80.0  # width and height of the sample
+spacing = 0.5  # distance between nodes
+boundary_rows = 8  # every nth row of nodes is on a grain boundary, with CSDMG output
+num_frames = 20
+tip_start, tip_end = 0.0, 60.0  # crack tip x position in the first and last frame
+peak_load = 4000.0  # total y reaction force on the top edge at the peak
+seed = 0  # damage noise away from the crack
+
+
+class OdbError(Exception):
+    pass
+
+
+class Repository(OrderedDict):
+    """
+    Abaqus repositories return lists from keys and values
+    """
+
+    def keys(self):
+        return list(OrderedDict.keys(self))
+
+    def values(self):
+        return list(OrderedDict.values(self))
+
+
+class FieldValue:
+    def __init__(self, nodeLabel, data, instance):
+        self.nodeLabel = nodeLabel
+        self.data = data
+        self.instance = instance
+
+
+class FieldBulkData:
+    def __init__(self, nodeLabels, data, instance):
+        self.nodeLabels = nodeLabels
+        self.data = data  # always (n, components), even for scalars
+        self.instance = instance
+
+
+class FieldOutput:
+    def __init__(self, name, labels, data, instance):
+        self.name = name
+        self._labels = np.asarray(labels, dtype=np.int32)
+        self._data = np.asarray(data, dtype=np.float32).reshape(len(labels), -1)
+        self._instance = instance
+        self._values = None
+        self.bulkDataBlocks = [FieldBulkData(self._labels, self._data, instance)]
+
+    @property
+    def values(self):  # built on first use, since only the slow path needs them
+        if self._values is None:
+            scalar = self._data.shape[1] == 1
+            self._values = [
+                FieldValue(
+                    int(label), float(row[0]) if scalar else row.copy(), self._instance
+                )
+                for label, row in zip(self._labels, self._data)
+            ]
+        return self._values
+
+    def getSubset(self, region):
+        mask = np.isin(self._labels, region.nodeLabels)
+        return FieldOutput(
+            self.name, self._labels[mask], self._data[mask], self._instance
+        )
+
+
+class OdbSet:
+    def __init__(self, name, nodeLabels):
+        self.name = name
+        self.nodeLabels = np.asarray(nodeLabels, dtype=np.int32)
+
+
+class OdbInstance:
+    def __init__(self, name, nodeSets):
+        self.name = name
+        self.nodeSets = nodeSets
+
+
+class OdbAssembly:
+    def __init__(self, instances):
+        self.instances = instances
+
+
+class OdbFrame:
+    def __init__(self, frameId, fieldOutputs):
+        self.frameId = frameId
+        self.fieldOutputs = fieldOutputs
+
+
+class OdbStep:
+    def __init__(self, name, frames):
+        self.name = name
+        self.frames = frames
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Odb:
+    def __init__(self, path):
+        self.name = path
+        n = int(round(size / spacing)) + 1
+        x, y = np.meshgrid(np.linspace(0, size, n), np.linspace(0, size, n))
+        self._coords = np.column_stack((x.ravel(), y.ravel()))
+        self._labels = np.arange(1, n * n + 1, dtype=np.int32)
+        rows = np.arange(n * n) // n
+        self._contact = (rows % boundary_rows == 0) | (rows == n // 2)
+        self._crack = rows == n // 2
+        self._top = self._labels[rows == n - 1]
+        self._noise = np.random.RandomState(seed).uniform(0, 0.02, n * n)
+
+        self._instance = OdbInstance("PART-1-1", {"TOP": OdbSet("TOP", self._top)})
+        self.rootAssembly = OdbAssembly(Repository([("PART-1-1", self._instance)]))
+        frames = [
+            _LazyFrame(self, frame_id) for frame_id in range(num_frames)
+        ]  # fields are made when a frame is first read, so opening is quick
+        self.steps = Repository([("Step-1", OdbStep("Step-1", frames))])
+        self.diagnosticData = _Namespace(
+            jobTime=_Namespace(wallclockTime=60.0 * num_frames)
+        )
+
+    def _fields(self, frame_id):
+        progress = frame_id / float(max(num_frames - 1, 1))
+        tip = tip_start + (tip_end - tip_start) * progress
+        # failed behind the tip, falling off over a few nodes ahead of it
+        dmg = np.where(
+            self._crack,
+            np.clip(1 - (self._coords[:, 0] - tip) / (4 * spacing), 0, 1),
+            self._noise * progress,
+        )
+        strain = 1e-3 * progress
+        coords = self._coords * [1, 1 + strain]
+        load = peak_load * np.sin(np.pi * min(progress * 1.5, 1.0))
+        rf = np.zeros((len(self._labels), 2))
+        rf[np.isin(self._labels, self._top), 1] = load / len(self._top)
+        contact = self._contact
+        return {
+            "COORD": FieldOutput("COORD", self._labels, coords, self._instance),
+            "CSDMG    General_Contact_Faces/General_Contact_Faces": FieldOutput(
+                "CSDMG", self._labels[contact], dmg[contact], self._instance
+            ),
+            "RF": FieldOutput("RF", self._labels, rf, self._instance),
+        }
+
+    def close(self):
+        pass
+
+
+class _LazyFrame(OdbFrame):
+    def __init__(self, odb, frameId):
+        self._odb = odb
+        self.frameId = frameId
+        self.frameValue = frameId / float(max(num_frames - 1, 1))  # step time
+        self._fieldOutputs = None
+
+    @property
+    def fieldOutputs(self):
+        if self._fieldOutputs is None:
+            self._fieldOutputs = self._odb._fields(self.frameId)
+        return self._fieldOutputs
+
+
+def openOdb(path, readOnly=True):
+    return Odb(path)
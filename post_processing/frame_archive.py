@@ -0,0 +1,133 @@
+# Columnar archive of the ODB frames, written once by odb_extractor.py and read by
+# post_processor.py and the animation maker instead of walking the ODB again.
+# {name}_frames/ holds
+#   index.json       metadata and one entry per frame, written last
+#   index.partial.json  the frames extracted so far, while the extraction is running
+#   labels.npz       node labels of each field, shared by every frame
+#   frame_00000.npz  coords, csdmg and rf_top of one frame, in the order of labels.npz
+# Kept python 2 compatible, since abaqus python reads and writes it
+import json, os
+import numpy as np
+
+index_filename = "index.json"
+partial_filename = "index.partial.json"
+labels_filename = "labels.npz"
+fields = ("coords", "csdmg", "rf_top")  # rf_top is the reaction force on the TOP set
+
+
+def archive_name(odb_filename):
+    """
+    Returns the archive directory of an odb file, {name}.odb -> {name}_frames
+    """
+    return os.path.splitext(odb_filename)[0] + "_frames"
+
+
+def frame_filename(i):
+    return "frame_%05d.npz" % i
+
+
+def replace_file(src, dst):
+    """
+    Renames src to dst, replacing dst. os.rename won't overwrite on windows,
+    and python 2 has no os.replace
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def save_labels(directory, labels):
+    np.savez(os.path.join(directory, labels_filename), **labels)
+
+
+def write_frame(directory, i, arrays, labels, shared_labels):
+    """
+    Saves frame i. Node labels are only stored with the frame
+    when they differ from the shared labels of that field
+    """
+    arrays = dict(arrays)
+    for field in fields:
+        if not np.array_equal(labels[field], shared_labels[field]):
+            arrays[field + "_labels"] = labels[field]
+    filename = os.path.join(directory, frame_filename(i))
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, **arrays)
+    replace_file(tmp_filename, filename)  # so a frame file is always complete
+
+
+def _save_json(filename, data):
+    with open(filename + ".tmp", "w") as f:
+        json.dump(data, f)
+    replace_file(filename + ".tmp", filename)
+
+
+def save_index(directory, index):
+    _save_json(os.path.join(directory, index_filename), index)
+    if os.path.isfile(os.path.join(directory, partial_filename)):
+        os.remove(os.path.join(directory, partial_filename))
+
+
+def save_partial(directory, entries):
+    """
+    Records the frames extracted so far, so an interrupted extraction can resume
+    """
+    _save_json(os.path.join(directory, partial_filename), entries)
+
+
+def load_partial(directory):
+    """
+    Returns the frame entries of an interrupted extraction, or an empty list
+    """
+    filename = os.path.join(directory, partial_filename)
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def load_labels(directory):
+    with np.load(os.path.join(directory, labels_filename)) as npz:
+        return dict((field, npz[field]) for field in fields)
+
+
+def load_index(directory):
+    """
+    Returns the archive metadata: odb, runtime and frames, a list of
+    {step, frame_id, frame_value, file}
+    """
+    with open(os.path.join(directory, index_filename), "r") as f:
+        return json.load(f)
+
+
+def is_complete(directory):
+    return os.path.isfile(os.path.join(directory, index_filename))
+
+
+def iter_frames(directory, index=None, start=0):
+    """
+    Yields each frame from number start as a dict of its index entry plus, for every field,
+    the data and its node labels as {field}_labels, reading one frame at a time
+    """
+    index = index or load_index(directory)
+    shared_labels = load_labels(directory)
+    for entry in index["frames"][start:]:
+        frame = dict(entry)
+        with np.load(os.path.join(directory, entry["file"])) as npz:
+            for field in fields:
+                frame[field] = npz[field]
+                label_key = field + "_labels"
+                if label_key in npz.files:
+                    frame[label_key] = npz[label_key]
+                else:
+                    frame[label_key] = shared_labels[field]
+        yield frame
+
+
+def by_label(labels, data):
+    """
+    Spreads data into a table indexed by node label
+    """
+    table = np.zeros((labels.max() + 1,) + data.shape[1:], dtype=data.dtype)
+    table[labels] = data
+    return table
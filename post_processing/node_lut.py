@@ -1,137 +1,425 @@
 # given an input file and a list of nodes,
 # find the properties of all nodes in the list
 # using a top-down approach
+# Run with python3 node_lut.py {name}.inp, saves node_lut.npz
+# or python3 node_lut.py --tree {sweep root} to build every outdated table in a sweep
+# Add --cache {directory} to share the mesh topology between variants of the same mesh
 
-from collections import defaultdict
-import re, json
+from array import array
+import re, json, os, time, io, hashlib
 import numpy as np
 
-element_def_regex = re.compile(r"^\s?(?:\d*,\s*)+\d*$")
-
 surf_def_regex = re.compile(
-    r"^\*Elset, elset=_(?P<surface>Surf-\d+)_(?P<face>S\d), internal, instance=Part-1-1$"
-)
-surf_def_generate_regex = re.compile(
-    r"^\*Elset, elset=_(?P<surface>Surf-\d+)_(?P<face>S\d), internal, instance=Part-1-1, generate$"
+    r"^\*Elset, elset=_(?P<surface>Surf-\d+)_(?P<face>S\d), internal, instance=Part-1-1(?P<generate>, generate)?$"
 )
 prop_def_regex = re.compile(r"\*Surface Interaction, name=(?P<mame>Prop-\d)")
 
 surf_prop_regex = re.compile(r"Surf-(?:\d+) , Surf-(?:\d+) , (?P<property>Prop-\d)")
 
+lut_filename = "node_lut.npz"
+
 
 class Section:
     def __init__(self, name):
         self.name = name
 
 
+other_section = Section("other")
 element_section = Section("elements")
 surface_section = Section("surfaces")
-interaction_property_section = Section("interaction_properties")
+strength_section = Section("strength")
+displacement_section = Section("displacement")
 prop_assignment = Section("properties")
 
 
-def find_node_properties(inp_file, debug=False):
-    property_dict = defaultdict(list)  # {property_name:[surf_id,...]}
-    surface_dict = defaultdict(dict)  # {surf_id:{face:element_list}}
-    element_dict = defaultdict(dict)  # {element_id:{face:node_list}}
-    interactions_dict = defaultdict(list)  # {property_name:[strength,displacement]}
-    try:
-        with open(inp_file, "r") as f:
-            inp_data = f.readlines()
-    except FileNotFoundError:
+def mesh_hash(inp_file: str) -> tuple:
+    """
+    Hashes the mesh part of the input file, from the first *Part to *End Assembly,
+    which is the same for every variant of a microstructure.
+    Returns the hash and the byte offset where the rest of the file starts,
+    or (None, 0) if the file has no assembly
+    """
+    sha = hashlib.sha1()
+    offset = 0
+    hashing = False
+    with open(inp_file, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if not hashing and not line.startswith(b"*Part"):
+                continue  # the heading has the job name, so it isn't part of the hash
+            hashing = True
+            sha.update(line)
+            if line.startswith(b"*End Assembly"):
+                return sha.hexdigest(), offset
+    return None, 0
+
+
+def surface_topology(elements, surface_faces: dict) -> dict:
+    """
+    Resolves every surface to the nodes on its faces.
+    The nodes of surface_names[i] are surface_nodes[surface_indptr[i]:surface_indptr[i+1]],
+    and num_nodes is one more than the largest node id
+    """
+    # element id -> nodes, as a dense table indexed by element id
+    elements = np.frombuffer(elements, dtype=np.int32).reshape(-1, 5)
+    connectivity = np.zeros((elements[:, 0].max() + 1, 4), dtype=np.int32)
+    connectivity[elements[:, 0]] = elements[:, 1:]
+    num_corners = np.where(connectivity[:, 3] > 0, 4, 3)
+
+    names = list(surface_faces)
+    counts = np.zeros(len(names), dtype=np.int64)
+    face_ids, element_ids = [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int32)]
+    for i, surface in enumerate(names):
+        for face, face_elements in surface_faces[surface]:
+            face_elements = np.frombuffer(face_elements, dtype=np.int32)
+            element_ids.append(face_elements)
+            face_ids.append(np.full(len(face_elements), int(face[1:]) - 1))
+            counts[i] += len(face_elements)
+    element_ids = np.concatenate(element_ids)
+    face_ids = np.concatenate(face_ids)
+    # face Sk runs from corner k-1 to the next corner, wrapping around
+    next_ids = (face_ids + 1) % num_corners[element_ids]
+    nodes = np.stack(
+        (
+            connectivity[element_ids, face_ids],
+            connectivity[element_ids, next_ids],
+        ),
+        axis=1,
+    )  # faces are in surface order, so the two nodes of each face stay with its surface
+    surface_indptr = np.zeros(len(names) + 1, dtype=np.int64)
+    surface_indptr[1:] = 2 * np.cumsum(counts)
+    return {
+        "surface_names": names,
+        "surface_indptr": surface_indptr,
+        "surface_nodes": nodes.ravel(),
+        "num_nodes": int(connectivity.max()) + 1,
+    }
+
+
+def load_topology(cache_dir: str, key: str):
+    """
+    Returns the cached surface topology for the mesh hash key, or None if there isn't one
+    """
+    cache_file = os.path.join(cache_dir, f"topology_{key}.npz")
+    if not os.path.isfile(cache_file):
+        return None
+    with np.load(cache_file) as npz:
+        topology = {k: npz[k] for k in npz.files}
+    topology["surface_names"] = topology["surface_names"].tolist()
+    topology["num_nodes"] = int(topology["num_nodes"])
+    return topology
+
+
+def save_topology(cache_dir: str, key: str, topology: dict):
+    """
+    Saves the surface topology for the mesh hash key, safe against other jobs doing the same
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, f"topology_{key}.npz")
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(f, **topology)
+    os.replace(tmp_file, cache_file)
+
+
+def find_node_properties(
+    inp_file, debug=False, output=lut_filename, cache_dir=None, mesh_key=None
+):
+    """
+    Reads the input file once, line by line, and saves which property applies to each node.
+    The output holds node_props, where node_props[node_id] is an index into the
+    names, strength and displacement arrays, and default, the index of Prop-1.
+    With a cache_dir, the surface topology is saved there by mesh hash, and
+    a later input file with the same mesh only reads what comes after the assembly.
+    mesh_key is the (key, mesh_end) mesh_hash returned, if the caller already has it
+    """
+    # element connectivity, stored flat as [element_id, n1, n2, n3, n4] with n4=0 for tris
+    elements = array("i")
+    surface_faces = {}  # {surf_id: [(face, element_array),...]}
+    interactions_dict = {}  # {property_name:[strength,displacement]}
+    property_dict = {}  # {property_name:[surf_id,...]}
+
+    if not os.path.isfile(inp_file):
         raise FileNotFoundError(f"INP file {inp_file} not found")
+    if not cache_dir:
+        key, mesh_end = None, 0
+    else:
+        key, mesh_end = mesh_key or mesh_hash(inp_file)
+    topology = load_topology(cache_dir, key) if key else None
+
+    raw = open(inp_file, "rb")
+    if (
+        topology is not None
+    ):  # same mesh as an earlier variant, skip to the interactions
+        raw.seek(mesh_end)
+        if debug:
+            print(f"Using cached topology {key}")
+    f = io.TextIOWrapper(raw)
+
+    state = other_section
+    with f:
+        for i, line in enumerate(f):
+            if line.startswith("**") or not line.strip():  # comment or blank
+                continue
+            if line.startswith("*"):  # keyword line, decides what the data lines are
+                line = line.strip()
+                state = other_section
+                if line.startswith("*Element,"):
+                    state = element_section
+                elif surf_def_regex.match(line):
+                    match = surf_def_regex.match(line)
+                    state = surface_section
+                    face_elements = array("i")
+                    generate = bool(match.group("generate"))
+                    surface_faces.setdefault(match.group("surface"), []).append(
+                        (match.group("face"), face_elements)
+                    )
+                elif prop_def_regex.match(line):
+                    prop_name = prop_def_regex.match(line).group("mame")
+                    interactions_dict[prop_name] = [None, None]
+                elif line.startswith("*Damage Initiation"):
+                    state = strength_section
+                elif line.startswith("*Damage Evolution"):
+                    state = displacement_section
+                elif line.startswith("*Contact Property Assignment"):
+                    state = prop_assignment
+                    if debug:
+                        print(f"Moving to property assignments at line {i+1}")
+                continue
 
-    state = element_section  # we start here
-
-    for i, line in enumerate(inp_data):
-        if state is element_section:
-            if element_def_regex.match(line):
-                element_id = line.split(",")[0].strip()
-                nodes = [_.strip() for _ in line.split(",")][1:]
-                if len(nodes) == 4:  # quad
-                    face2index = {
-                        "S1": [0, 1],
-                        "S2": [1, 2],
-                        "S3": [2, 3],
-                        "S4": [3, 0],
-                    }
-                elif len(nodes) == 3:  # tri
-                    face2index = {"S1": [0, 1], "S2": [1, 2], "S3": [2, 0]}
+            if state is element_section:
+                values = [int(_) for _ in line.split(",")]
+                if len(values) == 5:  # quad
+                    elements.extend(values)
+                elif len(values) == 4:  # tri
+                    elements.extend(values)
+                    elements.append(0)
                 else:
                     raise ValueError(
-                        f"Element with {len(nodes)} nodes not supported, see line {i+1}"
+                        f"Element with {len(values) - 1} nodes not supported, see line {i+1}"
                     )
-                for face, indexs in face2index.items():
-                    element_dict[element_id][face] = [nodes[i] for i in indexs]
-
-            elif line.startswith("*Nset"):  # move on
-                state = surface_section
-                print("Moving to surface assignments")
-
-        elif state is surface_section:
-            data_line = inp_data[i + 1]
-            if surf_def_regex.match(line):
-                match = surf_def_regex.match(line)
-                surface_id = match.group("surface")
-                face = match.group("face")
-                elements = [_.strip() for _ in data_line.split(",")]
-                surface_dict[surface_id][face] = list(
-                    filter(None, elements)
-                )  # remove empty strings
-
-            elif surf_def_generate_regex.match(line):
-                match = surf_def_generate_regex.match(line)
-                surface_id = match.group("surface")
-                face = match.group("face")
-                start, end, step = [int(_.strip(" ,")) for _ in data_line.split() if _]
-                elements = np.arange(start, end + 1, step)  # inclusive
-                surface_dict[surface_id][face] = [str(_) for _ in elements if _]
-            elif line.startswith("*End Assembly"):  # move on
-                state = interaction_property_section
-                print("Moving to interaction properties")
-
-        elif state is interaction_property_section:
-            if prop_def_regex.match(line):
-                name = prop_def_regex.match(line).group("mame")
-                strength_line = inp_data[i + 5]
-                strength = strength_line.split(",")[0].strip()
-                displacement_line = inp_data[i + 7]
-                displacement = displacement_line.split(",")[0].strip()
-                interactions_dict[name] = [strength, displacement]
-
-            elif line.startswith("*Contact Property Assignment"):  # move on
-                state = prop_assignment
-                print("Moving to property assignments")
-
-        elif state is prop_assignment:
-            if surf_prop_regex.match(line):
-                property = surf_prop_regex.match(line).group("property")
-                surfaces = [_.strip() for _ in line.split(",") if _][:-1]
-                property_dict[property].extend(surfaces)
-
-    print("Data collection finished, saving...")
-    if debug:
-        json.dump(
-            (property_dict, surface_dict, element_dict, interactions_dict),
-            open("data.json", "w"),
-        )
 
-    # recomine all data to get node properties
-    node_props = {}
+            elif state is surface_section:
+                values = [int(_) for _ in line.split(",") if _.strip()]
+                if generate:
+                    start, end, step = values
+                    face_elements.extend(range(start, end + 1, step))  # inclusive
+                else:
+                    face_elements.extend(values)
+
+            elif state is strength_section:
+                interactions_dict[prop_name][0] = float(line.split(",")[0])
+                state = other_section
+
+            elif state is displacement_section:
+                interactions_dict[prop_name][1] = float(line.split(",")[0])
+                state = other_section
+
+            elif state is prop_assignment:
+                if surf_prop_regex.match(line):
+                    property = surf_prop_regex.match(line).group("property")
+                    surfaces = [_.strip() for _ in line.split(",") if _][:-1]
+                    property_dict.setdefault(property, []).extend(surfaces)
+
+    print("Data collection finished, resolving nodes...")
+
+    if topology is None:
+        topology = surface_topology(elements, surface_faces)
+        if key:
+            save_topology(cache_dir, key, topology)
+    surface_index = {name: i for i, name in enumerate(topology["surface_names"])}
+    surface_indptr = topology["surface_indptr"]
+    surface_nodes = topology["surface_nodes"]
+
+    names = list(interactions_dict)
+    default = names.index("Prop-1")
+    node_props = np.full(
+        topology["num_nodes"],
+        default,
+        dtype=np.int8 if len(names) < 128 else np.int32,
+    )
     for property, surfaces in property_dict.items():
-        for surface in surfaces:
-            for face, elements in surface_dict[surface].items():
-                for element in elements:
-                    for node in element_dict[element][face]:
-                        if face in element_dict[element]:
-                            node_props[node] = interactions_dict[property]
-    node_props["default"] = interactions_dict["Prop-1"]
+        nodes = [
+            surface_nodes[surface_indptr[i] : surface_indptr[i + 1]]
+            for i in (surface_index[s] for s in surfaces if s in surface_index)
+        ]
+        if nodes:
+            node_props[np.concatenate(nodes)] = names.index(property)
+
+    tmp_output = output + ".tmp"  # so an interrupted run never leaves a partial table
+    with open(tmp_output, "wb") as lut_file:
+        np.savez_compressed(
+            lut_file,
+            node_props=node_props,
+            names=np.array(names),
+            strength=np.array([interactions_dict[n][0] for n in names], dtype=float),
+            displacement=np.array(
+                [interactions_dict[n][1] for n in names], dtype=float
+            ),
+            default=np.array(default),
+        )
+    os.replace(tmp_output, output)
+    print(f"Saved {output}")
+
+
+def load_node_lut(directory: str = ".") -> dict:
+    """
+    Loads the node lookup table in the directory, converting an older node_lut.json if needed
+    """
+    filename = os.path.join(directory, lut_filename)
+    if os.path.isfile(filename):
+        with np.load(filename) as npz:
+            lut = {key: npz[key] for key in npz.files}
+        lut["names"] = lut["names"].tolist()
+        lut["default"] = int(lut["default"])
+        return lut
+
+    # {node_id: [strength, displacement], "default": [strength, displacement]}
+    with open(os.path.join(directory, "node_lut.json"), "r") as json_file:
+        json_lut = json.load(json_file)
+    default_values = tuple(json_lut.pop("default"))
+    values = [default_values] + sorted(
+        {tuple(v) for v in json_lut.values()} - {default_values}
+    )
+    node_ids = np.array([int(k) for k in json_lut], dtype=np.int64)
+    node_props = np.zeros(node_ids.max() + 1 if len(node_ids) else 1, dtype=np.int32)
+    node_props[node_ids] = [values.index(tuple(v)) for v in json_lut.values()]
+    return {
+        "node_props": node_props,
+        "names": [f"Prop-{i + 1}" for i in range(len(values))],
+        "strength": np.array([float(v[0]) for v in values]),
+        "displacement": np.array([float(v[1]) for v in values]),
+        "default": 0,
+    }
+
 
-    json.dump(node_props, open("node_lut.json", "w"), indent=4)
+def node_property_index(lut: dict, node_ids) -> np.ndarray:
+    """
+    Returns the property index of each node id, ids past the end of the table
+    aren't on any surface and get the default
+    """
+    node_ids = np.asarray(node_ids).astype(np.int64)  # job_data.json may hold strings
+    props = np.full(len(node_ids), lut["default"], dtype=np.int64)
+    known = node_ids < len(lut["node_props"])
+    props[known] = lut["node_props"][node_ids[known]]
+    return props
+
+
+def find_stale(sweep_root: str) -> tuple:
+    """
+    Walks a sweep directory tree for input files whose lookup table, saved next to them,
+    is missing or older than the input file.
+    Returns a list of input files to process and a list of (directory, reason) to skip
+    """
+    todo, skipped = [], []
+    for root, dirs, files in os.walk(sweep_root):
+        dirs.sort()
+        inp_files = sorted(file for file in files if file.endswith(".inp"))
+        if not inp_files:
+            continue
+        if len(inp_files) > 1:  # one table per job directory
+            skipped.append((root, f"{len(inp_files)} input files"))
+            continue
+        inp_file = os.path.join(root, inp_files[0])
+        lut_file = os.path.join(root, lut_filename)
+        if not os.path.isfile(lut_file) or os.path.getmtime(
+            lut_file
+        ) < os.path.getmtime(inp_file):
+            todo.append(inp_file)
+    return todo, skipped
+
+
+def _tree_worker(inp_file: str, cache_dir: str = None, mesh_key=None) -> float:
+    """
+    Builds the table for one input file in its own directory, returns the runtime in seconds
+    """
+    ts = time.time()
+    find_node_properties(
+        inp_file,
+        output=os.path.join(os.path.dirname(inp_file), lut_filename),
+        cache_dir=cache_dir,
+        mesh_key=mesh_key,
+    )
+    return time.time() - ts
+
+
+def build_tree(sweep_root: str, workers: int = None, cache_dir: str = None) -> dict:
+    """
+    Builds every missing or outdated lookup table under sweep_root,
+    like the mod/strength/toughness folders made by vary_all_params.py,
+    spread across a process pool. Returns {input file: runtime in seconds}.
+    With a cache_dir, one input file per mesh is built first so
+    the other variants of that mesh find its topology in the cache
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    todo, skipped = find_stale(sweep_root)
+    for directory, reason in skipped:
+        print(f"Skipping {directory}, {reason}")
+    print(f"{len(todo)} lookup tables to build")
+
+    ts = time.time()
+    timings, failures = {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batches = [todo]
+        mesh_keys = {}  # {input file: (key, mesh_end)}, so each file is hashed once
+        if cache_dir:
+            mesh_keys = dict(zip(todo, pool.map(mesh_hash, todo)))
+            first = {}  # {mesh hash: first input file with that mesh}
+            for inp_file, (key, _) in mesh_keys.items():
+                first.setdefault(key, inp_file)
+            first = set(first.values())
+            batches = [
+                [inp_file for inp_file in todo if inp_file in first],
+                [inp_file for inp_file in todo if inp_file not in first],
+            ]
+            print(f"{len(first)} distinct meshes")
+        for batch in batches:
+            futures = {
+                pool.submit(
+                    _tree_worker, inp_file, cache_dir, mesh_keys.get(inp_file)
+                ): inp_file
+                for inp_file in batch
+            }
+            for future in as_completed(futures):
+                inp_file = futures[future]
+                try:
+                    timings[inp_file] = future.result()
+                except Exception as e:  # don't lose the rest of the sweep
+                    failures[inp_file] = e
+    elapsed = time.time() - ts
+
+    megabytes = sum(os.path.getsize(inp_file) for inp_file in timings) / 1e6
+    print(
+        f"Built {len(timings)} lookup tables in {elapsed:.2f} s"
+        f" ({megabytes:.1f} MB of input, {megabytes / max(elapsed, 1e-9):.1f} MB/s)"
+    )
+    if failures:
+        print(f"{len(failures)} failed:")
+        for inp_file, e in failures.items():
+            print(f"  {inp_file}: {e!r}")
+    return timings
 
 
 if __name__ == "__main__":
-    from sys import argv
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inp", nargs="?", help="input file, saves node_lut.npz here")
+    parser.add_argument(
+        "--tree",
+        help="sweep root, builds the missing or outdated tables of every job below it",
+    )
+    parser.add_argument("-j", "--workers", help="number of processes", type=int)
+    parser.add_argument(
+        "--cache", help="directory of mesh topologies shared between variants"
+    )
+    args = parser.parse_args()
 
-    # find_node_properties("post_processing/test.inp", debug=True)
-    find_node_properties(argv[1])
+    if args.tree:
+        build_tree(args.tree, workers=args.workers, cache_dir=args.cache)
+    elif args.inp:
+        # find_node_properties("post_processing/test.inp", debug=True)
+        find_node_properties(args.inp, cache_dir=args.cache)
+    else:
+        parser.error("give an input file or --tree")
@@ -0,0 +1,105 @@
+# Walks the ODB frames once and saves what the post processing needs to a frame archive,
+# see frame_archive.py. Everything downstream reads the archive instead of the ODB.
+# Run with abaqus python odb_extractor.py {name}.odb
+import os
+from odbAccess import *
+import numpy as np
+from frame_archive import (
+    archive_name,
+    frame_filename,
+    save_labels,
+    load_labels,
+    write_frame,
+    save_index,
+    save_partial,
+    load_partial,
+)
+
+csdmg_name = "CSDMG    General_Contact_Faces/General_Contact_Faces"
+checkpoint_every = 10  # frames between progress saves
+
+
+def bulk_data(field_output):
+    """
+    Returns the node labels and data of a field output as numpy arrays,
+    reading whole blocks instead of one value at a time
+    """
+    blocks = field_output.bulkDataBlocks
+    if not blocks:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 1))
+    labels = np.concatenate([np.asarray(block.nodeLabels) for block in blocks])
+    data = np.concatenate(
+        [np.asarray(block.data).reshape(len(block.nodeLabels), -1) for block in blocks]
+    )
+    return labels.astype(np.int32), data
+
+
+def extract(odb_filename, directory=None):
+    """
+    Saves COORD, CSDMG and RF on the TOP set of every frame, returns the archive directory.
+    An interrupted extraction picks up from its last saved progress
+    """
+    directory = directory or archive_name(odb_filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    odb = openOdb(path=odb_filename, readOnly=True)
+    top = odb.rootAssembly.instances["PART-1-1"].nodeSets["TOP"]
+
+    entries = load_partial(directory)
+    shared_labels = load_labels(directory) if entries else None
+    if entries:
+        print("Resuming after " + str(len(entries)) + " frames")
+    frame_number = 0
+    for step in odb.steps.values():
+        print("Extracting: " + step.name)
+        for frame in step.frames:
+            frame_number += 1
+            if frame_number <= len(entries):  # already in the archive
+                continue
+            coord_labels, coords = bulk_data(frame.fieldOutputs["COORD"])
+            csdmg_labels, csdmg = bulk_data(frame.fieldOutputs[csdmg_name])
+            top_labels, rf_top = bulk_data(
+                frame.fieldOutputs["RF"].getSubset(region=top)
+            )
+            labels = {
+                "coords": coord_labels,
+                "csdmg": csdmg_labels,
+                "rf_top": top_labels,
+            }
+            if shared_labels is None:  # the first frame's labels are used by all
+                shared_labels = labels
+                save_labels(directory, labels)
+            arrays = {
+                "coords": coords[:, :2].astype(np.float32),
+                "csdmg": csdmg[:, 0].astype(np.float32),
+                "rf_top": rf_top[:, :2].astype(np.float32),
+            }
+            write_frame(directory, len(entries), arrays, labels, shared_labels)
+            entries.append(
+                {
+                    "step": step.name,
+                    "frame_id": int(frame.frameId),
+                    "frame_value": float(frame.frameValue),
+                    "file": frame_filename(len(entries)),
+                }
+            )
+            if len(entries) % checkpoint_every == 0:
+                save_partial(directory, entries)
+
+    save_index(
+        directory,
+        {
+            "odb": os.path.basename(odb.name),
+            "runtime": float(odb.diagnosticData.jobTime.wallclockTime),
+            "frames": entries,
+        },
+    )
+    odb.close()
+    print("Saved " + str(len(entries)) + " frames to " + directory)
+    return directory
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    extract(argv[1])
@@ -1,14 +1,27 @@
 # Run with abaqus python .\post_processor.py .\precrack.odb
+# The ODB is read once into a frame archive, see frame_archive.py.
+# Once that exists, python3 can run this as well.
+# Progress is checkpointed, so rerunning an interrupted job picks up where it stopped
 
 import math, os
-from odbAccess import *
 from sys import argv
 import json
+import numpy as np
+from frame_archive import (
+    archive_name,
+    is_complete,
+    load_index,
+    iter_frames,
+    by_label,
+    replace_file,
+)
 
 # PROPERTIES TO CHANGE ========================
 max_delta_a = 10  # max crack length increase per increment
 dmg_thresh = 0.999
+checkpoint_every = 10  # frames between checkpoints
 # ==============================================
+checkpoint_filename = "post_processor_checkpoint.json"
 
 odb_filename = argv[1]
 # Load strength from the json file
@@ -31,99 +44,137 @@ def stress_intensity_factor(stress, a, width):
         * (
             1.12
             - 0.231 * a / width
-            + 10.55 * a / width ** 2
-            - 21.71 * a / width ** 3
-            + 30.382 * a / width ** 4
+            + 10.55 * a / width**2
+            - 21.71 * a / width**3
+            + 30.382 * a / width**4
         )
     )
 
 
+def node_coords(frame):
+    """
+    Returns an array of node coordinates in the frame indexed by node label
+    """
+    return by_label(frame["coords_labels"], frame["coords"])
+
+
+def save_checkpoint(frames_done, current_a, reached_end):
+    """
+    Saves the progress through the frames, the r-curve rows so far are
+    the first rcurve_size bytes of r-curve.txt
+    """
+    f.flush()
+    checkpoint = {
+        "odb": odb_filename,
+        "frames_done": frames_done,
+        "current_a": current_a,
+        "reached_end": reached_end,
+        "rcurve_size": os.path.getsize("r-curve.txt"),
+    }
+    with open(checkpoint_filename + ".tmp", "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    replace_file(checkpoint_filename + ".tmp", checkpoint_filename)
+
+
 # Objective: Generate a plot of crack length a vs stress intensity factor K
-odb = openOdb(path=odb_filename, readOnly=True)
+archive = archive_name(odb_filename)
+if not is_complete(archive):  # walk the ODB once, everything below reads the archive
+    from odb_extractor import extract  # needs abaqus python
+
+    extract(odb_filename, archive)
+index = load_index(archive)
 
 
 # ===============================================
 # Generate the r-curve, saved to r-curve.txt
 # ===============================================
 
-try:  # we append to the file, so if there's already one, delete it
-    os.remove("r-curve.txt")
-except OSError:  # file already deleted
-    pass
-f = open("r-curve.txt", "a")  # file to save data
-f.write("name=" + odb_filename + "\n")
-initial_x_values = [
-    value.data[0]  # x value for each node in first frame
-    for value in odb.steps.values()[0].frames[0].fieldOutputs["COORD"].values
-]
-x_offset = min(initial_x_values)
-width = max(initial_x_values) - x_offset
+# x and y value for each node in first frame
+initial_coords = next(iter_frames(archive, index))["coords"]
+initial_x_values = initial_coords[:, 0]
+x_offset = float(initial_x_values.min())
+width = float(initial_x_values.max()) - x_offset
 # find the precrack location
-initial_y_vals = [
-    value.data[1]  # x value for each node in first frame
-    for value in odb.steps.values()[0].frames[0].fieldOutputs["COORD"].values
-]
-height = max(initial_y_vals) - min(initial_y_vals)
+initial_y_vals = initial_coords[:, 1]
+height = float(initial_y_vals.max() - initial_y_vals.min())
 
 upper_lim = height / 2 + 0.05
 lower_lim = height / 2 - 0.05
-center_x_vals = [
-    v.data[0]  # x value of node
-    for v in odb.steps.values()[0].frames[0].fieldOutputs["COORD"].values  # first frame
-    if lower_lim < v.data[1] < upper_lim  # in the middle, where starting crack is
-]
-current_a = min(center_x_vals)  # starting crack x position,
+center_x_vals = initial_x_values[
+    (lower_lim < initial_y_vals) & (initial_y_vals < upper_lim)
+]  # in the middle, where starting crack is
+current_a = float(center_x_vals.min())  # starting crack x position,
 toughness = 0.5 * (strength * critical_displacement)
 print("Toughness = " + str(toughness))
 critical_sif = math.sqrt(toughness * modulus)
 print("Critical SIF:", critical_sif)
-for step in odb.steps.values():
-    print("Processing: " + step.name)
-    for frame in step.frames:
-        # load the data
-        csdmg = frame.fieldOutputs[
-            "CSDMG    General_Contact_Faces/General_Contact_Faces"
-        ]
-        coords = frame.fieldOutputs["COORD"]
-
-        # Find the crack tip
-        # loop through the nodes and check their CSDMG
-        for i in range(len(csdmg.values)):
-            x = coords.values[i].data[0]
-            if (
-                csdmg.values[i].data > dmg_thresh
-                and x > current_a
-                and x < current_a + max_delta_a  # only look just ahead previous crack
-            ):
-                # print("New crack tip at x=" + str(coords.values[i].data[0]))
-                current_a = coords.values[i].data[0]
-                if current_a >= width:  # we've reached the end of the sample
-                    print("End of sample reached")
-                    exit()  # end logging
-
-        # should have the leftmost failed node located at current_a
-        # which should be the crack tip
-        # Need to offset the crack since sample doesn't start at x=0
-        a = current_a - x_offset
-        print("Frame " + str(frame.frameId) + ": a=" + str(a)),
-
-        # Determine the stress applied to the sample
-        top = odb.rootAssembly.instances["PART-1-1"].nodeSets["TOP"]
-        rf = frame.fieldOutputs["RF"].getSubset(region=top)
-        f_total = 0
-        for f_val in rf.values:
-            # if f_val.data[1] > 0:  # exclude negative effects
-            f_total += f_val.data[1]  # sum up the y values
-        stress = f_total / width
-        print("Stress=" + str(round(stress, 2))),
-
-        # Determine the K_I
-        K_I = stress_intensity_factor(stress, a, width)
-        normalized = K_I / critical_sif
-        print("K_I=" + str(round(normalized)))
-
-        # Write the data to a file:
-        f.write(str(a / width) + "\t" + str(normalized) + "\n")
+
+checkpoint = None
+if os.path.isfile(checkpoint_filename) and os.path.isfile("r-curve.txt"):
+    with open(checkpoint_filename, "r") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint["odb"] != odb_filename:  # left over from something else
+        checkpoint = None
+if checkpoint:  # keep the rows up to the checkpoint and carry on from there
+    print("Resuming after " + str(checkpoint["frames_done"]) + " frames")
+    with open("r-curve.txt", "r+") as f:
+        f.truncate(checkpoint["rcurve_size"])
+    f = open("r-curve.txt", "a")
+    start = checkpoint["frames_done"]
+    current_a = checkpoint["current_a"]
+    reached_end = checkpoint["reached_end"]
+else:
+    f = open("r-curve.txt", "w")  # file to save data
+    f.write("name=" + odb_filename + "\n")
+    start = 0
+    reached_end = False
+
+step_name = None
+frames = iter_frames(archive, index, start) if not reached_end else []
+for i, frame in enumerate(frames, start):
+    if frame["step"] != step_name:
+        step_name = frame["step"]
+        print("Processing: " + step_name)
+    # load the data
+    dmg = frame["csdmg"]
+    x = node_coords(frame)[frame["csdmg_labels"], 0]
+
+    # Find the crack tip
+    # the furthest failed node just ahead of the previous crack tip
+    ahead = (
+        (dmg > dmg_thresh)
+        & (x > current_a)
+        & (x < current_a + max_delta_a)  # only look just ahead previous crack
+    )
+    if ahead.any():
+        current_a = float(x[np.where(ahead, x, -np.inf).argmax()])
+        # print("New crack tip at x=" + str(current_a))
+        if current_a >= width:  # we've reached the end of the sample
+            print("End of sample reached")
+            reached_end = True
+            save_checkpoint(i, current_a, reached_end)
+            break  # end logging
+
+    # should have the leftmost failed node located at current_a
+    # which should be the crack tip
+    # Need to offset the crack since sample doesn't start at x=0
+    a = current_a - x_offset
+    print("Frame " + str(frame["frame_id"]) + ": a=" + str(a)),
+
+    # Determine the stress applied to the sample
+    f_total = float(frame["rf_top"][:, 1].sum())  # sum up the y values
+    stress = f_total / width
+    print("Stress=" + str(round(stress, 2))),
+
+    # Determine the K_I
+    K_I = stress_intensity_factor(stress, a, width)
+    normalized = K_I / critical_sif
+    print("K_I=" + str(round(normalized)))
+
+    # Write the data to a file:
+    f.write(str(a / width) + "\t" + str(normalized) + "\n")
+    if (i + 1) % checkpoint_every == 0:
+        save_checkpoint(i + 1, current_a, reached_end)
 f.close()
 
 
@@ -131,37 +182,28 @@ f.close()
 # Find crack path in final frame
 # ===============================================
 
-x_array = []
-y_array = []
-node_id_array = []
-dmg_array = []
-
-frame = odb.steps.values()[-1].frames[-1]
-coords = frame.fieldOutputs["COORD"]
-csdmg = frame.fieldOutputs["CSDMG    General_Contact_Faces/General_Contact_Faces"]
-for i in range(len(csdmg.values)):
-    if csdmg.values[i].data > 0.01:
-        x_array.append(coords.values[i].data[0])
-        y_array.append(coords.values[i].data[1])
-        dmg_array.append(csdmg.values[i].data)
-        node_id_array.append(coords.values[i].nodeLabel)
-# abaqus python returns values as numpy floats,
-# so we need to make them native before serialization
-x_array = [float(i) for i in x_array]
-y_array = [float(i) for i in y_array]
-node_id_array = [str(i) for i in node_id_array]
+frame = next(iter_frames(archive, index, len(index["frames"]) - 1))
+dmg_labels, dmg = frame["csdmg_labels"], frame["csdmg"]
+failed = dmg > 0.01
+failed_coords = node_coords(frame)[dmg_labels[failed]]
+# numpy values need to be made native before serialization
+x_array = failed_coords[:, 0].tolist()
+y_array = failed_coords[:, 1].tolist()
+dmg_array = dmg[failed].tolist()
+node_id_array = dmg_labels[failed].tolist()
 json_data = {
-    "title": os.path.basename(odb.name).split(".")[0],
+    "title": index["odb"].split(".")[0],
     "x_values": x_array,
     "y_values": y_array,
     "dmg_values": dmg_array,
     "num_failed_nodes": len(x_array),
     "mesh_size": mesh_size,
     "crack_path_length": len(x_array) * mesh_size,
-    "runtime": odb.diagnosticData.jobTime.wallclockTime,  # wallclock time in seconds
+    "runtime": index["runtime"],  # wallclock time in seconds
     "toughness": toughness,
     "node_ids": node_id_array,
+    "end_of_sample": reached_end,  # crack reached the far edge before the last frame
 }
 json.dump(json_data, open("job_data.json", "w"))
-
-odb.close()
+if os.path.isfile(checkpoint_filename):  # finished, so a rerun starts over
+    os.remove(checkpoint_filename)
@@ -0,0 +1,124 @@
+# Crack length binning for the report generator, kept separate so it can be imported and timed.
+# Compare against the old row by row accumulation with python3 report_binning.py --benchmark 500
+import argparse, time
+import numpy as np
+import pandas as pd
+
+bins = np.linspace(0, 80, 20)  # left edge of each crack length bin
+bin_width = 4
+
+
+def bin_toughness(
+    bigdf: pd.DataFrame,
+    bins: np.ndarray = bins,
+    bin_width: float = bin_width,
+    closed: str = "left",
+) -> pd.DataFrame:
+    """
+    Averages the normalized toughness of each group in crack length bins
+    [bin, bin + bin_width), or (bin, bin + bin_width) with closed="neither".
+    Returns a, group, avg, max and min for every group and bin with data,
+    with groups in order of first appearance and bins in increasing order.
+    The bins must not overlap
+    """
+    # edges alternate between the start and end of each bin, so even codes are in a bin
+    # and odd codes fall in the gap before the next one
+    edges = np.column_stack((bins, bins + bin_width)).ravel()
+    codes = pd.cut(bigdf["a"], edges, right=False, labels=False).to_numpy()
+    codes = np.nan_to_num(codes, nan=-1).astype(int)  # -1 past either end
+    inside = (codes >= 0) & (codes % 2 == 0)
+    if closed == "neither":
+        inside &= bigdf["a"].to_numpy() != np.take(edges, codes, mode="clip")
+    elif closed != "left":
+        raise ValueError("closed must be left or neither")
+    bin_ids = codes[inside] // 2
+    binned = pd.DataFrame(
+        {
+            "a": bins[bin_ids],
+            "group": pd.Categorical(
+                bigdf["group"][inside], categories=bigdf["group"].unique()
+            ),
+            "normalized_tough": bigdf["normalized_tough"].to_numpy()[inside],
+        }
+    )
+    avgdf = (
+        binned.groupby(["group", "a"], observed=True)["normalized_tough"]
+        .agg(avg="mean", max="max", min="min")
+        .reset_index()
+    )
+    avgdf["group"] = avgdf["group"].astype(str)
+    return avgdf[["a", "group", "avg", "max", "min"]]
+
+
+def _bin_toughness_rows(bigdf, bins=bins, bin_width=bin_width, closed="left"):
+    """
+    The previous implementation, one filter per group and bin and one row appended at a time
+    """
+    avgdf = pd.DataFrame()
+    for group in bigdf["group"].unique():
+        groupdata = bigdf[bigdf["group"] == group]
+        for bin in bins:
+            above = bin <= groupdata["a"] if closed == "left" else bin < groupdata["a"]
+            binned = groupdata[above & (groupdata["a"] < bin + bin_width)]
+            if len(binned) == 0:
+                continue
+            row = {
+                "a": bin,
+                "group": group,
+                "avg": binned["normalized_tough"].mean(),
+                "max": binned["normalized_tough"].max(),
+                "min": binned["normalized_tough"].min(),
+            }
+            avgdf = pd.concat([avgdf, pd.DataFrame([row])], ignore_index=True)
+    return avgdf
+
+
+def synthetic_sweep(num_jobs: int, nodes_per_job: int = 2000, replicates: int = 5):
+    """
+    Returns (list of per job frames, bigdf) shaped like a sweep, grouped by replicate
+    """
+    rng = np.random.default_rng(0)
+    frames = []
+    for job in range(num_jobs):
+        a = np.sort(rng.uniform(0, 80, nodes_per_job))
+        frames.append(
+            pd.DataFrame(
+                {
+                    "a": a,
+                    "normalized_tough": rng.uniform(0.5, 2, nodes_per_job),
+                    "group": f"mod_{job // replicates}e-01_str_ratio_1e+00",
+                }
+            )
+        )
+    return frames, pd.concat(frames, ignore_index=True)
+
+
+def benchmark(num_jobs: int):
+    frames, bigdf = synthetic_sweep(num_jobs)
+
+    ts = time.time()
+    old_bigdf = pd.DataFrame()
+    for df in frames:  # what DataFrame.append did, a full copy per job
+        old_bigdf = pd.concat([old_bigdf, df], ignore_index=True)
+    old_avgdf = _bin_toughness_rows(old_bigdf)
+    old_time = time.time() - ts
+
+    ts = time.time()
+    new_avgdf = bin_toughness(pd.concat(frames, ignore_index=True))
+    new_time = time.time() - ts
+
+    pd.testing.assert_frame_equal(old_avgdf, new_avgdf, check_dtype=False)
+    print(
+        f"{num_jobs} jobs, {len(bigdf)} rows, {len(new_avgdf)} bins: "
+        f"row by row {old_time:.2f} s, grouped {new_time:.3f} s, "
+        f"{old_time / new_time:.0f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--benchmark", help="number of synthetic jobs", type=int, required=True
+    )
+    args = parser.parse_args()
+    benchmark(args.benchmark)
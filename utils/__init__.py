@@ -25,6 +25,24 @@ def midpoints(region):  # list[list[float]]) -> list[list[float]]
     return output
 
 
+def centroid(region):  # list[list[float]]) -> list[float]
+    """
+    takes in a region defined as a set of corner points and returns its area centroid
+    """
+    area = 0
+    cx = 0
+    cy = 0
+    for i in range(1, len(region) + 1):
+        i = i % len(region)  # wrap around
+        p1 = region[i - 1]
+        p2 = region[i]
+        cross = p1[0] * p2[1] - p2[0] * p1[1]
+        area += cross / 2
+        cx += (p1[0] + p2[0]) * cross
+        cy += (p1[1] + p2[1]) * cross
+    return [cx / (6 * area), cy / (6 * area)]
+
+
 def length_scale(
     stiffness: float = 370e9,
     strength: float = 1e5,
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def soln_1(p1: list, p2: list, p3: list, d) -> list:
     x1, y1 = p1
     x2, y2 = p2
@@ -449,6 +452,32 @@ def scale(p1: list, p2: list, p3: list, distance) -> list:
                 raise Exception("I give up")
 
 
+def scale_many(prev, curr, next, distance) -> np.ndarray:
+    """
+    Vectorized version of scale. Takes (N,2) arrays of the previous, current and next corners
+    of every polygon, returns an (N,2) array of points moved the given distance along the
+    interior bisector of each corner.
+    """
+    prev = np.asarray(prev, dtype=float)
+    curr = np.asarray(curr, dtype=float)
+    next = np.asarray(next, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # sum of the unit vectors along both sides points along the interior bisector
+        u1 = prev - curr
+        u1 /= np.linalg.norm(u1, axis=1)[:, None]
+        u3 = next - curr
+        u3 /= np.linalg.norm(u3, axis=1)[:, None]
+        bisector = u1 + u3
+        length = np.linalg.norm(bisector, axis=1)
+        direction = bisector / length[:, None]
+    # straight lines (and zero-length sides) have no interior bisector,
+    # so just move the point along the x axis towards p1 like scale does
+    invalid = ~(length > 1e-12)  # also catches NaN
+    direction[invalid, 0] = np.where(prev[invalid, 0] < curr[invalid, 0], -1.0, 1.0)
+    direction[invalid, 1] = 0.0
+    return curr + distance * direction
+
+
 if __name__ == "__main__":
     d = 0.5
     p1 = [2.375, 4.5]
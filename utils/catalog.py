@@ -0,0 +1,171 @@
+# Index of the pregenerated microstructure library, stored as json lines
+# so finding usable seeds doesn't need a filesystem check per seed.
+# Rebuild the index for an existing library with python3 catalog.py build {directory},
+# or update one structure, once its CAE file is built, with python3 catalog.py add {json file}.
+# Those updates come from many jobs at once, so each goes to its own file in catalog.d/
+# instead of being appended to the catalog, and build folds them back in
+import json, os, random, re, argparse
+
+catalog_name = "catalog.jsonl"
+pending_dirname = "catalog.d"  # one entry file per structure added by a job
+pregen_regex = re.compile(r"^size_(?P<size>\d+)_seed_(?P<seed>\d+)\.json$")
+
+
+def catalog_entry(json_filename: str) -> dict:
+    """
+    Reads the json file written by generate and returns its catalog entry.
+    File paths are stored relative to the catalog directory, and the model file
+    is only listed once it exists, so a CAE file still being built is left out
+    """
+    with open(json_filename, "r") as json_file:
+        data = json.load(json_file)
+    name = os.path.basename(json_filename)[: -len(".json")]
+    model_file = {}
+    if os.path.isfile(json_filename[: -len(".json")] + ".inp"):  # native
+        model_file["inp"] = f"{name}.inp"
+    if os.path.isfile(json_filename[: -len(".json")] + ".cae"):  # CAE script was run
+        model_file["cae"] = f"{name}.cae"
+    if os.path.isfile(json_filename[: -len(".json")] + ".npz"):
+        model_file["npz"] = f"{name}.npz"
+    return {
+        "seed": data["seed"],
+        "size": data["size"],
+        "mesh_size": data["mesh_size"],
+        "coh_stiffness": data["coh_stiffness"],
+        "num_grains": len(data["grain_array"]),
+        "files": {"json": f"{name}.json", "png": f"{name}.png", **model_file},
+    }
+
+
+def add_to_catalog(catalog_filename: str, entries: list):
+    """
+    Appends entries to the catalog, one line each.
+    Only for a single writer, jobs running at once use add_pending
+    """
+    with open(catalog_filename, "a") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+def add_pending(directory: str, json_filename: str):
+    """
+    Writes the catalog entry of one structure to its own file in catalog.d/,
+    so jobs adding different structures never write to the same file
+    """
+    pending_dir = os.path.join(directory, pending_dirname)
+    os.makedirs(pending_dir, exist_ok=True)
+    filename = os.path.join(pending_dir, os.path.basename(json_filename))
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(catalog_entry(json_filename), f)
+    os.replace(tmp_filename, filename)
+
+
+def pending_files(directory: str) -> list:
+    pending_dir = os.path.join(directory, pending_dirname)
+    if not os.path.isdir(pending_dir):
+        return []
+    return [
+        os.path.join(pending_dir, file)
+        for file in sorted(os.listdir(pending_dir))
+        if file.endswith(".json")
+    ]
+
+
+def load_catalog(catalog_filename: str) -> list:
+    """
+    Returns all entries in the catalog and catalog.d/, the last entry wins if a seed
+    was added twice. Lines that can't be read are skipped with a warning
+    """
+    entries = {}
+
+    def add(entry_text: str, where: str):
+        try:
+            entry = json.loads(entry_text)
+            entries[(entry["size"], entry["seed"])] = entry
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Warning: skipping unreadable catalog entry at {where}: {e}")
+
+    with open(catalog_filename, "r") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                add(line, f"{catalog_filename}:{i + 1}")
+    for filename in pending_files(os.path.dirname(catalog_filename)):
+        with open(filename, "r") as f:
+            add(f.read(), filename)
+    return list(entries.values())
+
+
+def sample_seeds(
+    catalog_filename: str,
+    n: int,
+    size: int = None,
+    mesh_size: float = None,
+    coh_stiffness: float = None,
+    model: str = None,
+    exclude: list = (),
+) -> list:
+    """
+    Picks n distinct seeds from the catalog matching the given parameters,
+    reading only the catalog file itself.
+    model="cae" or "inp" only picks seeds with that model file
+    """
+    if model not in (None, "cae", "inp"):
+        raise ValueError("model must be cae or inp")
+    candidates = [
+        entry["seed"]
+        for entry in load_catalog(catalog_filename)
+        if (size is None or entry["size"] == size)
+        and (mesh_size is None or entry["mesh_size"] == mesh_size)
+        and (coh_stiffness is None or entry["coh_stiffness"] == coh_stiffness)
+        and (model is None or model in entry["files"])
+        and entry["seed"] not in exclude
+    ]
+    if len(candidates) < n:
+        raise ValueError(
+            f"Only {len(candidates)} matching seeds in {catalog_filename}, {n} requested"
+        )
+    return random.sample(candidates, n)
+
+
+def build_catalog(directory: str) -> str:
+    """
+    Indexes every pregenerated json file in the directory, replacing any existing catalog
+    and the entries in catalog.d/ it has folded in. Returns the catalog filename
+    """
+    folded = pending_files(directory)  # anything added after this is kept
+    entries = [
+        catalog_entry(os.path.join(directory, file))
+        for file in sorted(os.listdir(directory))
+        if pregen_regex.match(file)
+    ]
+    catalog_filename = os.path.join(directory, catalog_name)
+    tmp_filename = catalog_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+    os.replace(tmp_filename, catalog_filename)
+    for filename in folded:
+        os.remove(filename)
+    print(f"Indexed {len(entries)} microstructures in {catalog_filename}")
+    return catalog_filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="index an existing library")
+    build_parser.add_argument("directory", help="directory of pregenerated files")
+    add_parser = subparsers.add_parser("add", help="add or update one structure")
+    add_parser.add_argument("json", help="json file written by generate")
+    sample_parser = subparsers.add_parser("sample", help="print random seeds")
+    sample_parser.add_argument("catalog", help="catalog file")
+    sample_parser.add_argument("n", help="number of seeds", type=int)
+    sample_parser.add_argument("--size", type=int)
+    sample_parser.add_argument("--model", choices=("cae", "inp"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_catalog(args.directory)
+    elif args.command == "add":
+        add_pending(os.path.dirname(os.path.abspath(args.json)), args.json)
+    else:
+        print(*sample_seeds(args.catalog, args.n, size=args.size, model=args.model))
@@ -1,6 +1,7 @@
-from functools import wraps
+from functools import wraps, lru_cache
 from os import write
 from typing import List, Text, TextIO
+import numpy as np
 
 
 def interaction_property(
@@ -59,6 +60,37 @@ mdb.models['Model-1'].interactions['{interaction}'].contactPropertyAssignments.a
     )
 
 
+def unique_pairs(assignments: list) -> list:
+    """
+    Drops repeated surface pairs from [(surf_1, surf_2, prop_name), ...],
+    including the same pair in reverse order. The first one is kept
+    """
+    unique = {}  # dicts keep the insertion order
+    for surf_1, surf_2, prop_name in assignments:
+        unique.setdefault(frozenset((surf_1, surf_2)), (surf_1, surf_2, prop_name))
+    return list(unique.values())
+
+
+def property_assignments(
+    f: TextIO, interaction: str, assignments: list, chunk_size: int = 1000
+):
+    """
+    All property assignments at once, [(surf_1, surf_2, prop_name), ...] as input.
+    Symmetric duplicates are dropped, and each appendInStep call gets up to chunk_size pairs
+    """
+    assignments = unique_pairs(assignments)
+    f.write("\ns=mdb.models['Model-1'].rootAssembly.surfaces\n")
+    for i in range(0, len(assignments), chunk_size):
+        pairs = "".join(
+            f"    (s['{surf_1}'], s['{surf_2}'], '{prop_name}'),\n"
+            for surf_1, surf_2, prop_name in assignments[i : i + chunk_size]
+        )
+        f.write(
+            f"mdb.models['Model-1'].interactions['{interaction}'].contactPropertyAssignments.appendInStep(\n"
+            f"    stepName='Initial', assignments=(\n{pairs}))\n"
+        )
+
+
 def surface_maker(f: TextIO, surface_name: str, surface_points):
     """
     [[x1,y1],[x2,y2],...] as input
@@ -161,6 +193,43 @@ def line_writer(f: TextIO, p1: list, p2: list):
     f.write(f"s.Line(point1=({p1[0]}, {p1[1]}), point2=({p2[0]}, {p2[1]}))\n")
 
 
+def sketch_writer(f: TextIO, grains, per_line: int = 4) -> int:
+    """
+    Writes the outline of every grain as one table of corners and grain offsets,
+    which a short loop in the script turns into sketch lines, instead of one s.Line call
+    per edge. Takes a list of [[x1,y1],[x2,y2],...] and returns the number of sketch lines
+    """
+    grains = [np.asarray(points, dtype=float) for points in grains]
+    corners = np.concatenate(grains).tolist()
+    offsets = np.zeros(len(grains) + 1, dtype=int)
+    offsets[1:] = np.cumsum([len(points) for points in grains])
+    # repr keeps full precision, so the outlines are the same as with s.Line
+    corner_rows = [
+        " ".join(f"({x!r}, {y!r})," for x, y in corners[i : i + per_line])
+        for i in range(0, len(corners), per_line)
+    ]
+    offset_rows = [
+        " ".join(f"{o}," for o in offsets[i : i + 16].tolist())
+        for i in range(0, len(offsets), 16)
+    ]
+    f.write(
+        "corners = (\n"
+        + "\n".join(corner_rows)
+        + "\n)\noffsets = (\n"
+        + "\n".join(offset_rows)
+        + """
+)
+for g in range(len(offsets) - 1):
+    start, end = offsets[g], offsets[g + 1]
+    for i in range(start, end):
+        j = i + 1 if i + 1 < end else start  # wrap around
+        s.Line(point1=corners[i], point2=corners[j])
+del corners, offsets
+"""
+    )
+    return len(corners)
+
+
 def mesh(f: TextIO, seed_size=0.11):
     f.write(
         f"""
@@ -198,9 +267,36 @@ a.Set(faces=faces1, name='{set_name}')
     )
 
 
-def encastre(f: TextIO, bc_name: str = "BC-1", threshold=1.5):
+def part_face_set(f: TextIO, set_name: str, points: list):
+    """
+    Makes a part set from the faces at the given points, [[x1,y1],[x2,y2],...] as input
+    """
+    if not len(points):  # findAt() with no points only fails once cae runs the script
+        raise ValueError(
+            f"No points given for the {set_name} face set, no grain lies there"
+        )
+    coords = "".join(f"(({x:.6f}, {y:.6f}, 0.0), ), " for x, y in points)
+    # using :.6f to round the value since findAt only supports 1e-6 precision
+    # the points are unpacked from a tuple, since abaqus python 2.7 won't compile
+    # a call with more than 255 arguments
     f.write(
         f"""
+points = ({coords})
+p.Set(name='{set_name}', faces=p.faces.findAt(*points))
+"""
+    )
+
+
+def encastre(f: TextIO, bc_name: str = "BC-1", threshold=1.5, points: list = None):
+    """
+    If the points inside the bottom grains are given, the set is made directly
+    instead of checking the centroid of every face against the threshold
+    """
+    if points is not None:
+        part_face_set(f, "bottom", points)
+    else:
+        f.write(
+            f"""
 f=p.faces
 botfaces = []
 for i in f:
@@ -209,7 +305,10 @@ for i in f:
         index=i.index
         botfaces.append(f[index:index+1])
 p.Set(name='bottom',faces=botfaces)
-
+"""
+        )
+    f.write(
+        f"""
 a = mdb.models['Model-1'].rootAssembly
 region = a.instances['Part-1-1'].sets['bottom']
 
@@ -220,10 +319,23 @@ mdb.models['Model-1'].EncastreBC(name='{bc_name}', createStepName='Initial',
 
 
 def top_displacement(
-    f: TextIO, bc_name: str = "BC-1", u1="UNSET", u2="UNSET", u3="UNSET", threshold=0.5
+    f: TextIO,
+    bc_name: str = "BC-1",
+    u1="UNSET",
+    u2="UNSET",
+    u3="UNSET",
+    threshold=0.5,
+    points: list = None,
 ):
-    f.write(
-        f"""
+    """
+    If the points inside the top grains are given, the set is made directly
+    instead of checking the centroid of every face against the threshold
+    """
+    if points is not None:
+        part_face_set(f, "top", points)
+    else:
+        f.write(
+            f"""
 f=p.faces
 topfaces = []
 for i in f:
@@ -232,6 +344,10 @@ for i in f:
         index=i.index
         topfaces.append(f[index:index+1])
 p.Set(name='top',faces=topfaces)
+"""
+        )
+    f.write(
+        f"""
 a = mdb.models['Model-1'].rootAssembly
 region = a.instances['Part-1-1'].sets['top']
 mdb.models['Model-1'].DisplacementBC(name='{bc_name}', createStepName='Step-1', 
@@ -271,3 +387,334 @@ mdb.jobs['{jobname}'].writeInput(consistencyChecking=OFF)
 mdb.saveAs('{jobname}')
 """
     )
+
+
+##########################################
+# Native input file writer, bypasses CAE #
+##########################################
+
+
+@lru_cache(maxsize=None)
+def _grain_template(n: int, k: int):
+    """
+    Structured mesh of a convex polygon with n corners, split into n triangular sectors
+    around the center with k layers each.
+    Returns the weights of every node relative to the corners, the quad and tri connectivity
+    and the indices of the quads (face S2) and tris (face S1) on the outside of the polygon
+    """
+    ids = {}
+    weights = [np.zeros(n)]  # center node
+
+    def node(i, j, l):  # sector i, layer j, position l along the layer
+        if j == 0:
+            return 0
+        if l == 0:  # shared with the previous sector
+            key = ("radial", i % n, j)
+        elif l == j:  # shared with the next sector
+            key = ("radial", (i + 1) % n, j)
+        else:
+            key = ("sector", i, j, l)
+        if key not in ids:
+            w = np.zeros(n)
+            if key[0] == "radial":
+                w[key[1]] = j / k
+            else:
+                w[i] = (j - l) / k
+                w[(i + 1) % n] = l / k
+            ids[key] = len(weights)
+            weights.append(w)
+        return ids[key]
+
+    quads, tris, quad_faces, tri_faces = [], [], [], []
+    for i in range(n):
+        for j in range(k):
+            # the strip between layers j and j+1 is j quads and a tri at the end
+            for l in range(j):
+                quads.append(
+                    (
+                        node(i, j, l),
+                        node(i, j + 1, l),
+                        node(i, j + 1, l + 1),
+                        node(i, j, l + 1),
+                    )
+                )
+                if j == k - 1:
+                    quad_faces.append(len(quads) - 1)
+            tris.append((node(i, j + 1, j), node(i, j + 1, j + 1), node(i, j, j)))
+            if j == k - 1:
+                tri_faces.append(len(tris) - 1)
+    return (
+        np.array(weights),
+        np.array(quads, dtype=int).reshape(-1, 4),
+        np.array(tris, dtype=int).reshape(-1, 3),
+        np.array(quad_faces, dtype=int),
+        np.array(tri_faces, dtype=int),
+    )
+
+
+def mesh_grain(points, seed_size=0.11):
+    """
+    Meshes a convex grain given as [[x1,y1],[x2,y2],...] with CPS4 and CPS3 elements.
+    Returns the node coordinates, the quad and tri connectivity (0-indexed, counterclockwise)
+    and the indices of the quads and tris on the grain boundary
+    """
+    points = np.asarray(points, dtype=float)
+    x, y = points.T
+    if np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)) < 0:
+        points = points[::-1]  # elements need to be counterclockwise
+    center = points.mean(axis=0)
+    radius = np.linalg.norm(points - center, axis=1).max()
+    k = max(1, int(np.ceil(radius / seed_size)))  # number of layers
+    weights, quads, tris, quad_faces, tri_faces = _grain_template(len(points), k)
+    nodes = center + weights @ (points - center)
+    return nodes, quads, tris, quad_faces, tri_faces
+
+
+def _data_lines(values, per_line=16):
+    """
+    Splits a list of labels into comma separated data lines, 16 per line like Abaqus does
+    """
+    values = [str(v) for v in values]
+    return [
+        ", ".join(values[i : i + per_line]) + ","
+        for i in range(0, len(values), per_line)
+    ]
+
+
+def native_mesh_sections(
+    grain_array: dict,
+    seed_size: float = 0.11,
+    bottom_threshold: float = 2,
+    top_threshold: float = None,
+) -> str:
+    """
+    Meshes the grains and returns the part and assembly sections of the input file.
+    These only depend on the geometry, so variants of one microstructure can share them.
+    Grains with a centroid below bottom_threshold go in the bottom set, and grains with a
+    centroid above top_threshold go in the top set
+    """
+    from utils import centroid
+
+    if top_threshold is None:
+        top_threshold = max(p[1] for grain in grain_array.values() for p in grain) - 2
+
+    node_blocks, quad_blocks, tri_blocks = [], [], []
+    surfaces = {}  # {grain_id: (quad boundary ids, tri boundary ids)}
+    sets = {
+        "bottom": ([], []),
+        "top": ([], []),
+    }  # {set_name: (node ranges, element ranges)}
+    n_nodes, n_elements = 0, 0
+    for g, points in grain_array.items():
+        nodes, quads, tris, quad_faces, tri_faces = mesh_grain(points, seed_size)
+        # Abaqus labels start at 1
+        node_blocks.append(nodes)
+        quad_ids = n_elements + 1 + np.arange(len(quads))
+        tri_ids = n_elements + 1 + len(quads) + np.arange(len(tris))
+        quad_blocks.append(np.column_stack((quad_ids, quads + n_nodes + 1)))
+        tri_blocks.append(np.column_stack((tri_ids, tris + n_nodes + 1)))
+        surfaces[g] = (quad_ids[quad_faces], tri_ids[tri_faces])
+        y = centroid(points)[1]
+        for set_name, in_set in (
+            ("bottom", y < bottom_threshold),
+            ("top", y > top_threshold),
+        ):
+            if in_set:
+                sets[set_name][0].append((n_nodes + 1, n_nodes + len(nodes)))
+                sets[set_name][1].append(
+                    (n_elements + 1, n_elements + len(quads) + len(tris))
+                )
+        n_nodes += len(nodes)
+        n_elements += len(quads) + len(tris)
+
+    lines = [
+        "** PARTS",
+        "**",
+        "*Part, name=Part-1",
+        "*Node",
+    ]
+    nodes = np.concatenate(node_blocks)
+    # repr keeps the decimal point so node lines can't be mistaken for elements
+    lines += [f"{i}, {x!r}, {y!r}" for i, (x, y) in enumerate(nodes.tolist(), start=1)]
+    for elem_type, blocks in (("CPS4", quad_blocks), ("CPS3", tri_blocks)):
+        elements = np.concatenate(blocks)
+        if len(elements):
+            lines.append(f"*Element, type={elem_type}")
+            lines += [", ".join(map(str, e)) for e in elements.tolist()]
+    lines += [
+        "*Nset, nset=All, generate",
+        f" 1, {n_nodes}, 1",
+        "*Elset, elset=All, generate",
+        f" 1, {n_elements}, 1",
+    ]
+    for set_name, (node_ranges, element_ranges) in sets.items():
+        lines.append(f"*Nset, nset={set_name}")
+        lines += _data_lines(
+            [i for start, end in node_ranges for i in range(start, end + 1)]
+        )
+        lines.append(f"*Elset, elset={set_name}")
+        lines += _data_lines(
+            [i for start, end in element_ranges for i in range(start, end + 1)]
+        )
+    lines += [
+        "** Section: Section-1",
+        "*Solid Section, elset=All, material=Alumina",
+        ",",
+        "*End Part",
+        "**",
+        "** ASSEMBLY",
+        "**",
+        "*Assembly, name=Assembly",
+        "**",
+        "*Instance, name=Part-1-1, part=Part-1",
+        "*End Instance",
+        "**",
+    ]
+    for g, (quad_faces, tri_faces) in surfaces.items():
+        faces = []
+        for face, elements in (("S1", tri_faces), ("S2", quad_faces)):
+            if len(elements):
+                lines.append(
+                    f"*Elset, elset=_Surf-{g}_{face}, internal, instance=Part-1-1"
+                )
+                lines += _data_lines(elements.tolist())
+                faces.append(face)
+        lines.append(f"*Surface, type=ELEMENT, name=Surf-{g}")
+        lines += [f"_Surf-{g}_{face}, {face}" for face in faces]
+    lines.append("*End Assembly")
+    return "\n".join(lines) + "\n"
+
+
+def native_inp(
+    f: TextIO,
+    jobname: str,
+    grain_array: dict,
+    properties: dict,
+    assignments: list = (),
+    seed_size: float = 0.11,
+    coh_stiffness: float = 1e9,
+    viscosity: float = None,
+    modulus: float = 370e9,
+    poisson: float = 0.25,
+    bottom_threshold: float = 2,
+    top_threshold: float = None,
+    u2: float = 0.001,
+    mesh_sections: str = None,
+):
+    """
+    Meshes the grains and writes the whole input file without going through CAE.
+    grain_array is {grain_id: [[x1,y1],[x2,y2],...]}, properties is
+    {prop_name: (strength, critical_displacement)} with Prop-1 as the global property,
+    and assignments is [(surf_1, surf_2, prop_name), ...].
+    Grains with a centroid below bottom_threshold are fixed, and grains with a centroid
+    above top_threshold are displaced by u2.
+    Pass mesh_sections from native_mesh_sections to skip meshing again.
+    """
+    if mesh_sections is None:
+        mesh_sections = native_mesh_sections(
+            grain_array, seed_size, bottom_threshold, top_threshold
+        )
+    f.write(
+        "\n".join(
+            [
+                "*Heading",
+                f"** Job name: {jobname} Model name: Model-1",
+                "** Generated by: polyxtal2d",
+                "*Preprint, echo=NO, model=NO, history=NO, contact=NO",
+                "**",
+            ]
+        )
+        + "\n"
+    )
+    f.write(mesh_sections)
+    lines = [
+        "*Contact Initialization Data, name=CInit-1, search above=0.006, search below=1.",
+        "**",
+        "** MATERIALS",
+        "**",
+        "*Material, name=Alumina",
+        "*Elastic",
+        f"{modulus}, {poisson}",
+        "**",
+        "** INTERACTION PROPERTIES",
+        "**",
+    ]
+    for prop_name, (strength, crit_disp) in properties.items():
+        # node_lut reads the first value after *Damage Initiation as the strength
+        # and after *Damage Evolution as the critical displacement
+        lines += [
+            f"*Surface Interaction, name={prop_name}",
+            "1.,",
+            "*Cohesive Behavior",
+            f"{coh_stiffness}, {coh_stiffness}, {coh_stiffness}",
+            "*Damage Initiation, criterion=MAXS",
+            f"{strength}, {strength}, {strength}",
+            "*Damage Evolution, type=DISPLACEMENT",
+            f"{crit_disp},",
+        ]
+        if viscosity:
+            lines += ["*Damage Stabilization", f"{viscosity}"]
+    lines += [
+        "**",
+        "** BOUNDARY CONDITIONS",
+        "**",
+        "** Name: BC-1 Type: Symmetry/Antisymmetry/Encastre",
+        "*Boundary",
+        "Part-1-1.bottom, ENCASTRE",
+        "**",
+        "** INTERACTIONS",
+        "**",
+        "** Interaction: General",
+        "*Contact, op=NEW",
+        "*Contact Inclusions, ALL EXTERIOR",
+        "*Contact Property Assignment",
+        " ,  , Prop-1",
+    ]
+    lines += [
+        f"{surf_1} , {surf_2} , {prop}"
+        for surf_1, surf_2, prop in unique_pairs(assignments)
+    ]
+    lines += [
+        "*Surface Property Assignment, property=THICKNESS",
+        " , 0.005, 1.",
+        "*Contact Initialization Assignment",
+        " ,  , CInit-1",
+        "** ----------------------------------------------------------------",
+        "**",
+        "** STEP: Step-1",
+        "**",
+        "*Step, name=Step-1, nlgeom=NO, inc=10000",
+        "*Static",
+        "0.01, 1., 1e-05, 0.01",
+        "**",
+        "** CONTROLS",
+        "**",
+        "*Controls, reset",
+        "*Controls, analysis=discontinuous",
+        "**",
+        "** BOUNDARY CONDITIONS",
+        "**",
+        "** Name: BC-2 Type: Displacement/Rotation",
+        "*Boundary",
+        f"Part-1-1.top, 2, 2, {u2}",
+        "**",
+        "** OUTPUT REQUESTS",
+        "**",
+        "*Restart, write, frequency=0",
+        "**",
+        "** FIELD OUTPUT: F-Output-1",
+        "**",
+        "*Output, field",
+        "*Node Output",
+        "CF, COORD, RF, U",
+        "*Element Output, directions=YES",
+        "LE, PE, PEEQ, PEMAG, S",
+        "*Contact Output",
+        "CDISP, CSDMG, CSTATUS, CSTRESS",
+        "**",
+        "** HISTORY OUTPUT: H-Output-1",
+        "**",
+        "*Output, history, variable=PRESELECT",
+        "*End Step",
+    ]
+    f.write("\n".join(lines) + "\n")
@@ -0,0 +1,139 @@
+# Compact binary storage for microstructures, faster to load than the json export.
+# Convert existing json files with python3 microstructure.py {json files}
+import json, struct, zipfile
+import numpy as np
+
+metadata_keys = [
+    "size",
+    "seed",
+    "prop_1",
+    "prop_2",
+    "plastic_displacement",
+    "mesh_size",
+    "coh_stiffness",
+    "lengthscale1",
+    "lengthscale2",
+    "vor_regions_length",
+]
+
+
+def save_microstructure(filename: str, data: dict):
+    """
+    Saves the dict written to json by generate as an npz file.
+    Grain corners are stored as one flat (N,2) vertex array, with grain i spanning
+    vertices[offsets[i]:offsets[i+1]]. The neighbors of grain id g are
+    neighbor_indices[neighbor_indptr[g]:neighbor_indptr[g+1]]
+    """
+    grain_array = data["grain_array"]
+    grain_ids = np.array(list(grain_array), dtype=np.int64)
+    offsets = np.zeros(len(grain_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(grain_array[g]) for g in grain_array])
+    vertices = np.array(
+        [p for g in grain_array for p in grain_array[g]], dtype=np.float64
+    ).reshape(-1, 2)
+    centers = np.array(
+        [data["grain_centers"][g] for g in grain_array], dtype=np.float64
+    ).reshape(-1, 2)
+    metadata = {k: data[k] for k in metadata_keys if k in data}
+    adjacency = {  # grain neighbors in CSR format, indexed by grain id
+        k: np.asarray(data[k], dtype=np.int64)
+        for k in ("neighbor_indptr", "neighbor_indices")
+        if k in data
+    }
+    np.savez(  # not compressed, so the arrays can be memory-mapped
+        filename,
+        vertices=vertices,
+        offsets=offsets,
+        grain_ids=grain_ids,
+        centers=centers,
+        metadata=np.array(json.dumps(metadata)),
+        **adjacency,
+    )
+
+
+def _npz_memmap(filename: str, mmap_mode: str = "r") -> dict:
+    """
+    np.load can't memory-map arrays inside an npz, but savez stores them uncompressed,
+    so map each member directly from its offset in the zip file
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, "rb") as f:
+        for info in zf.infolist():
+            key = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:  # savez_compressed
+                arrays[key] = np.load(zf.open(info))
+                continue
+            # skip the local file header, its name and extra fields are variable length
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if shape == () or 0 in shape:  # can't map these, but they're tiny
+                count = int(np.prod(shape))
+                arrays[key] = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+            else:
+                arrays[key] = np.memmap(
+                    filename,
+                    dtype=dtype,
+                    mode=mmap_mode,
+                    shape=shape,
+                    order="F" if fortran else "C",
+                    offset=f.tell(),
+                )
+    return arrays
+
+
+def load_microstructure(filename: str, mmap_mode: str = "r") -> dict:
+    """
+    Loads an npz microstructure into the same layout as the json file,
+    with grain_array and grain_centers holding array views instead of lists.
+    The raw arrays are included as well. Set mmap_mode to None to read everything into memory
+    """
+    if mmap_mode:
+        arrays = _npz_memmap(filename, mmap_mode)
+    else:
+        with np.load(filename) as npz:
+            arrays = {key: npz[key] for key in npz.files}
+    data = json.loads(str(arrays["metadata"]))
+    vertices = arrays["vertices"]
+    offsets = arrays["offsets"].tolist()
+    grain_ids = arrays["grain_ids"].tolist()
+    data["grain_array"] = {
+        g: vertices[offsets[i] : offsets[i + 1]] for i, g in enumerate(grain_ids)
+    }
+    data["grain_centers"] = dict(zip(grain_ids, arrays["centers"]))
+    data.update(
+        vertices=vertices,
+        offsets=arrays["offsets"],
+        grain_ids=arrays["grain_ids"],
+        centers=arrays["centers"],
+    )
+    for key in ("neighbor_indptr", "neighbor_indices"):
+        if key in arrays:  # older files don't have the adjacency
+            data[key] = arrays[key]
+    return data
+
+
+def json_to_npz(json_filename: str) -> str:
+    """
+    Converts a json microstructure from generate into an npz file next to it
+    """
+    with open(json_filename, "r") as json_file:
+        data = json.load(json_file)
+    keyint = lambda dict_: {int(k): v for k, v in dict_.items()}
+    data["grain_array"] = keyint(data["grain_array"])
+    data["grain_centers"] = keyint(data["grain_centers"])
+    npz_filename = json_filename.replace(".json", ".npz")
+    save_microstructure(npz_filename, data)
+    return npz_filename
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    for json_filename in argv[1:]:
+        print(f"Converted {json_to_npz(json_filename)}")